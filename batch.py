@@ -0,0 +1,164 @@
+"""Generate prompts for many project briefs without the Streamlit UI.
+
+Each input line is a JSON object with `project_description`, `key_features`
+and `technical_requirements`, plus optional `id`, `clarifying_questions` and
+`answers`. Records run through the same Step 2 and Step 3 calls as the app:
+
+- without `answers`, only the clarifying questions are generated and the
+  record is written with status "awaiting_answers";
+- with `answers`, the final prompt is generated as well (reusing
+  `clarifying_questions` from the input when present) with status "ok".
+
+Results are appended to the output JSONL as each record finishes, and records
+already in the output are skipped, so an interrupted run resumes where it
+stopped. Failed records are written with status "error" and retried on the
+next run.
+
+    python batch.py briefs.jsonl results.jsonl --workers 4 --rpm 50
+
+The API key is read from .streamlit/secrets.toml or ANTHROPIC_API_KEY.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from langchain_core.messages import HumanMessage
+
+from main import STEP_FINAL, STEP_QUESTIONS, call_model, format_final_input, format_user_parameters
+
+logger = logging.getLogger("batch")
+
+DONE_STATUSES = ("ok", "awaiting_answers")
+
+
+class RateLimiter:
+    """Spaces out calls so that at most `per_minute` start in any minute."""
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        time.sleep(max(0.0, start - now))
+
+
+def read_records(path):
+    """Yield (id, record) for each non-empty line of `path`."""
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            yield str(record.get("id", line_number)), record
+
+
+def finished_ids(path):
+    """Return the ids already completed in output file `path`."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by an interrupted run; the record is redone
+                continue
+            if result.get("status") in DONE_STATUSES:
+                done.add(str(result["id"]))
+    return done
+
+
+def generate(record_id, record, limiter, use_cache=True):
+    """Run Step 2 and, if answers are present, Step 3 for one record."""
+    started = time.perf_counter()
+    user_parameters = format_user_parameters(
+        record.get("project_description", ""),
+        record.get("key_features", ""),
+        record.get("technical_requirements", ""),
+    )
+    result = {"id": record_id, "user_parameters": user_parameters}
+
+    clarifying_questions = record.get("clarifying_questions")
+    if not clarifying_questions:
+        limiter.wait()
+        response = call_model(
+            {"messages": [HumanMessage(content=user_parameters)]}, use_cache=use_cache, step=STEP_QUESTIONS
+        )
+        clarifying_questions = response["messages"][0].content
+    result["clarifying_questions"] = clarifying_questions
+
+    answers = record.get("answers")
+    if answers:
+        limiter.wait()
+        final_input = format_final_input(user_parameters, clarifying_questions, answers)
+        response = call_model(
+            {"messages": [HumanMessage(content=final_input)]}, use_cache=use_cache, step=STEP_FINAL
+        )
+        result["user_answers"] = answers
+        result["final_prompt"] = response["messages"][0].content
+        result["status"] = "ok"
+    else:
+        result["status"] = "awaiting_answers"
+
+    result["elapsed"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def run(input_path, output_path, workers=4, rpm=50.0, use_cache=True):
+    """Process every unfinished record of `input_path`. Returns the number of failures."""
+    done = finished_ids(output_path)
+    pending = [(record_id, record) for record_id, record in read_records(input_path) if record_id not in done]
+    logger.info("%d records pending, %d already done", len(pending), len(done))
+
+    limiter = RateLimiter(rpm)
+    failures = 0
+    write_lock = threading.Lock()
+    with open(output_path, "a") as out, ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(generate, record_id, record, limiter, use_cache): record_id
+            for record_id, record in pending
+        }
+        for future in as_completed(futures):
+            record_id = futures[future]
+            try:
+                result = future.result()
+            except Exception as exc:
+                logger.exception("record %s failed", record_id)
+                result = {"id": record_id, "status": "error", "error": repr(exc)}
+                failures += 1
+            with write_lock:
+                out.write(json.dumps(result) + "\n")
+                out.flush()
+            logger.info("record %s: %s", record_id, result["status"])
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate prompts for a JSONL file of project briefs.")
+    parser.add_argument("input", help="input JSONL of project briefs")
+    parser.add_argument("output", help="output JSONL; also the resume checkpoint")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent records (default 4)")
+    parser.add_argument("--rpm", type=float, default=50.0, help="max model requests per minute, 0 for no limit")
+    parser.add_argument("--no-cache", action="store_true", help="always ask the model for a fresh sample")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
+    failures = run(args.input, args.output, args.workers, args.rpm, use_cache=not args.no_cache)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,284 @@
+"""Benchmarks for the prompt pipeline, run against a deterministic fake model.
+
+`ChatAnthropic` is replaced by `FakeChatModel`, which returns the same text for
+the same input after a configurable first-token latency and token rate, so the
+numbers measure our own code rather than the API. Stages:
+
+- template:  rendering the meta-prompt template into messages
+- join:      joining the HumanMessages of a state (`_input_text`)
+- call:      one uncached `call_model` round trip
+- sections:  one uncached section-wise final prompt (`stream_sections`), a
+             non-streaming `call_model` per section
+- stream:    one uncached `stream_model` round trip
+- graph:     one run of the compiled `StateGraph`
+- flow:      the three steps of `generate_prompt_page` driven by Streamlit's
+             AppTest, including reruns and session state handling
+
+For each stage the median and p95 time per operation, operations per second
+and peak traced memory are reported. Baselines are plain JSON:
+
+    python bench.py --save bench_baseline.json
+    python bench.py --compare bench_baseline.json --tolerance 0.25
+
+`--compare` exits non-zero when a stage's median is slower than the baseline
+by more than the tolerance. Everything runs offline.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from typing import Any, Iterator, List, Optional
+
+# Keep the cache and checkpoint files out of the working tree
+_workdir = tempfile.mkdtemp(prefix="bench-")
+os.environ.setdefault("RESPONSE_CACHE_PATH", os.path.join(_workdir, "responses.sqlite3"))
+os.environ.setdefault("CHECKPOINT_PATH", os.path.join(_workdir, "checkpoints.sqlite3"))
+os.environ.setdefault("SIMILARITY_INDEX_PATH", os.path.join(_workdir, "briefs.sqlite3"))
+os.environ.setdefault("HISTORY_PATH", os.path.join(_workdir, "history.sqlite3"))
+os.environ.setdefault("ARTIFACT_STORE_PATH", os.path.join(_workdir, "artifacts.sqlite3"))
+# Every flow submits the same brief; reusing its questions would skip Step 2
+os.environ.setdefault("SIMILARITY_SUGGEST_THRESHOLD", "2")
+os.environ.setdefault("SIMILARITY_SERVE_THRESHOLD", "2")
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+import main
+from cache import ResponseCache
+
+WORDS = (
+    "frontend backend database docker compose terraform makefile react flask "
+    "postgres tests routes models schemas linting pipeline deploy build"
+).split()
+
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic stand-in for `ChatAnthropic`."""
+
+    latency: float = 0.0
+    """Seconds before the first token."""
+    tokens_per_second: float = 0.0
+    """Output rate after the first token; 0 means instant."""
+    output_tokens: int = 200
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def _tokens(self, messages: List[BaseMessage]) -> List[str]:
+        seed = hashlib.sha256("".join(str(m.content) for m in messages).encode("utf-8")).digest()
+        rng = random.Random(seed)
+        return [rng.choice(WORDS) + " " for _ in range(self.output_tokens)]
+
+    def _usage(self, messages, tokens):
+        input_tokens = sum(len(str(m.content)) for m in messages) // 4
+        return {"input_tokens": input_tokens, "output_tokens": len(tokens), "total_tokens": input_tokens + len(tokens)}
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        tokens = self._tokens(messages)
+        time.sleep(self.latency + (len(tokens) / self.tokens_per_second if self.tokens_per_second else 0))
+        usage = self._usage(messages, tokens)
+        # Like ChatAnthropic, pass on the API's usage, whose cache fields may be null
+        message = AIMessage(
+            content="".join(tokens),
+            usage_metadata=usage,
+            response_metadata={"usage": {
+                "input_tokens": usage["input_tokens"],
+                "output_tokens": usage["output_tokens"],
+                "cache_creation_input_tokens": None,
+                "cache_read_input_tokens": None,
+            }},
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        tokens = self._tokens(messages)
+        time.sleep(self.latency)
+        for token in tokens:
+            if self.tokens_per_second:
+                time.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(messages, tokens)))
+
+
+def install_fake_model(model: FakeChatModel):
+    """Route every chain lookup in `main` to `model`, with response caching off."""
+    chain = main.build_chain(model)
+    main.get_chain = lambda *args, **kwargs: chain
+    main.response_cache = ResponseCache(tiers=[])
+
+
+def sample_state(size: int = 1):
+    brief = main.format_user_parameters(
+        "An internal admin dashboard for managing customer accounts. " * size,
+        "CRUD for accounts, role-based access, audit log. " * size,
+        "Flask API, PostgreSQL, SSO login. " * size,
+    )
+    return {"messages": [HumanMessage(content=brief)]}
+
+
+def sample_final_state():
+    return {
+        "user_parameters": main._input_text(sample_state()),
+        "clarifying_questions": "1. How many users?\n2. Where will it be deployed?\n3. Which SSO provider?",
+        "user_answers": "About ten users.\n\nOn Linode.\n\nOkta.",
+    }
+
+
+def measure(fn, repeat: int, warmup: int = 1) -> dict:
+    """Time `fn` `repeat` times, then trace the peak memory of one more call.
+
+    Memory is traced separately because tracemalloc slows the traced code down.
+    """
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    timings.sort()
+    median = statistics.median(timings)
+    return {
+        "median_ms": median * 1000,
+        "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000,
+        "ops_per_sec": 1 / median if median else float("inf"),
+        "peak_kib": peak / 1024,
+    }
+
+
+def _app_script():
+    from main import generate_prompt_page
+
+    generate_prompt_page()
+
+
+def _wait_for(at, key, timeout=60):
+    """Rerun the page until the background job behind session state `key` lands."""
+    deadline = time.perf_counter() + timeout
+    while not at.session_state[key] and not at.exception:
+        if time.perf_counter() > deadline:
+            raise RuntimeError(f"timed out waiting for {key}")
+        time.sleep(0.01)
+        at.run()
+
+
+def run_flow():
+    """Drive Steps 1-3 of the page and return per-step wall times in ms."""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_function(_app_script, default_timeout=60)
+    steps = {}
+    started = time.perf_counter()
+    at.run()
+    steps["render"] = time.perf_counter() - started
+
+    at.text_area[0].input("An internal admin dashboard")
+    at.text_area[1].input("CRUD, roles, audit log")
+    at.text_area[2].input("Flask, PostgreSQL")
+    started = time.perf_counter()
+    at.button[0].click().run()
+    _wait_for(at, "clarifying_questions")
+    steps["step2"] = time.perf_counter() - started
+
+    at.text_area[0].input("Ten users, deploy on Linode")
+    started = time.perf_counter()
+    at.button[0].click().run()
+    _wait_for(at, "final_prompt")
+    steps["step3"] = time.perf_counter() - started
+
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    if not at.session_state["final_prompt"]:
+        raise RuntimeError("flow did not produce a final prompt")
+    return {name: seconds * 1000 for name, seconds in steps.items()}
+
+
+def run(repeat: int, model: FakeChatModel) -> dict:
+    install_fake_model(model)
+    state = sample_state()
+    input_text = main._input_text(state)
+    final_state = sample_final_state()
+    app = main.get_app()
+
+    results = {
+        "template": measure(lambda: main.prompt.format_messages(input=input_text), repeat * 10),
+        "join": measure(lambda: main._input_text(state), repeat * 100),
+        "call": measure(lambda: main.call_model(state, use_cache=False), repeat),
+        "stream": measure(lambda: "".join(main.stream_model(state, use_cache=False)), repeat),
+        "sections": measure(lambda: "".join(main.stream_sections(final_state, use_cache=False)), repeat),
+        "graph": measure(
+            lambda: app.invoke(sample_state(), {"configurable": {"thread_id": str(uuid.uuid4())}}),
+            repeat,
+        ),
+    }
+    flow_runs = []
+    results["flow"] = measure(lambda: flow_runs.append(run_flow()), max(1, repeat // 5))
+    results["flow"]["steps_ms"] = {
+        step: statistics.median(run[step] for run in flow_runs) for step in flow_runs[0]
+    }
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Return a message for every stage whose median regressed beyond `tolerance`."""
+    regressions = []
+    for stage, stats in results.items():
+        if stage not in baseline:
+            continue
+        before, after = baseline[stage]["median_ms"], stats["median_ms"]
+        if before and after > before * (1 + tolerance):
+            regressions.append(f"{stage}: {after:.3f} ms vs baseline {before:.3f} ms (+{(after / before - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the prompt pipeline against a fake model.")
+    parser.add_argument("--repeat", type=int, default=20, help="timed repetitions per stage")
+    parser.add_argument("--latency", type=float, default=0.0, help="fake first-token latency in seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="fake output rate, 0 for instant")
+    parser.add_argument("--output-tokens", type=int, default=200, help="fake reply length in tokens")
+    parser.add_argument("--save", metavar="PATH", help="write results as a baseline")
+    parser.add_argument("--compare", metavar="PATH", help="fail on regression against a baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown for --compare")
+    args = parser.parse_args(argv)
+
+    model = FakeChatModel(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        output_tokens=args.output_tokens,
+    )
+    results = run(args.repeat, model)
+
+    print(f"{'stage':<10}{'median ms':>12}{'p95 ms':>12}{'ops/s':>12}{'peak KiB':>12}")
+    for stage, stats in results.items():
+        print(f"{stage:<10}{stats['median_ms']:>12.3f}{stats['p95_ms']:>12.3f}{stats['ops_per_sec']:>12.1f}{stats['peak_kib']:>12.1f}")
+    for step, ms in results["flow"]["steps_ms"].items():
+        print(f"  flow {step:<8}{ms:>10.1f} ms")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION:", regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,153 @@
+"""Content-addressed cache for model responses.
+
+Responses are keyed on a hash of everything that determines them (system
+template, model, temperature and input text) and stored in a small in-process
+LRU tier backed by an on-disk SQLite tier. Both tiers are bounded in size and
+entries expire after a TTL.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from storage import SQLiteStore
+
+DEFAULT_PATH = os.environ.get("RESPONSE_CACHE_PATH", os.path.join(".cache", "responses.sqlite3"))
+DEFAULT_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", 7 * 24 * 3600))
+
+
+def cache_key(template: str, model: str, temperature: float, input_text: str) -> str:
+    """Return the content address of a response."""
+    payload = json.dumps([template, model, temperature, input_text], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryTier:
+    """In-process LRU tier."""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int = 256, ttl: float = DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, stored_at = entry
+            if time.time() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def size(self) -> int:
+        """Approximate bytes of the cached responses."""
+        with self._lock:
+            return sum(len(value.encode("utf-8")) for value, _ in self._entries.values())
+
+
+class SQLiteTier(SQLiteStore):
+    """On-disk tier, evicting least recently used entries beyond `max_entries`."""
+
+    name = "disk"
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS responses ("
+        "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+        "stored_at REAL NOT NULL, accessed_at REAL NOT NULL)",
+    )
+
+    def __init__(self, path: str = DEFAULT_PATH, max_entries: int = 5000, ttl: float = DEFAULT_TTL):
+        super().__init__(path)
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock, self.conn:
+            row = self.conn.execute(
+                "SELECT value FROM responses WHERE key = ? AND stored_at > ?",
+                (key, now - self.ttl),
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, stored_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self.conn.execute("DELETE FROM responses WHERE stored_at <= ?", (now - self.ttl,))
+            self.conn.execute(
+                "DELETE FROM responses WHERE key NOT IN "
+                "(SELECT key FROM responses ORDER BY accessed_at DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+
+    def clear(self) -> None:
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM responses")
+
+
+class ResponseCache:
+    """Tiered response cache. Tiers are checked in order and a hit in a slower
+    tier is copied into the faster ones."""
+
+    def __init__(self, tiers=None):
+        self.tiers = tiers if tiers is not None else [MemoryTier(), SQLiteTier()]
+        self._lock = threading.Lock()
+        self._stats = {"misses": 0, "sets": 0}
+        for tier in self.tiers:
+            self._stats[f"{tier.name}_hits"] = 0
+
+    def get(self, key: str) -> Optional[str]:
+        for i, tier in enumerate(self.tiers):
+            value = tier.get(key)
+            if value is not None:
+                for faster in self.tiers[:i]:
+                    faster.set(key, value)
+                self._count(f"{tier.name}_hits")
+                return value
+        self._count("misses")
+        return None
+
+    def set(self, key: str, value: str) -> None:
+        for tier in self.tiers:
+            tier.set(key, value)
+        self._count("sets")
+
+    def clear(self) -> None:
+        for tier in self.tiers:
+            tier.clear()
+
+    def stats(self) -> dict:
+        """Return a snapshot of the hit/miss counters."""
+        with self._lock:
+            return dict(self._stats)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
@@ -0,0 +1,100 @@
+"""Smoke-test batch.py end to end against the synthetic transport.
+
+Writes a few briefs, with and without answers, to a temporary directory and
+runs `python batch.py` on them in a fresh interpreter with LLM_TRANSPORT=
+synthetic, so no network or API key is needed. Fails unless the run exits
+cleanly and every record is written with the status it should have.
+
+    python check_batch.py [--records 6] [--workers 4]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def briefs(count: int):
+    """Return `count` briefs; every other one carries answers."""
+    records = []
+    for i in range(count):
+        record = {
+            "id": f"smoke-{i}",
+            "project_description": f"smoke test project {i}",
+            "key_features": "login, search",
+            "technical_requirements": "python, sqlite",
+        }
+        if i % 2:
+            record["answers"] = "Keep it small."
+        records.append(record)
+    return records
+
+
+def run(records, workers: int):
+    """Run batch.py over `records`; return its exit code, output and results by id."""
+    with tempfile.TemporaryDirectory(prefix="check-batch-") as workdir:
+        source = os.path.join(workdir, "briefs.jsonl")
+        target = os.path.join(workdir, "results.jsonl")
+        with open(source, "w") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        env = dict(
+            os.environ,
+            LLM_TRANSPORT="synthetic",
+            LLM_SYNTHETIC_LATENCY="0",
+            LLM_SYNTHETIC_TOKENS_PER_SECOND="0",
+            RESPONSE_CACHE_PATH=os.path.join(workdir, "responses.sqlite3"),
+            CHECKPOINT_PATH=os.path.join(workdir, "checkpoints.sqlite3"),
+            SIMILARITY_INDEX_PATH=os.path.join(workdir, "briefs.sqlite3"),
+            HISTORY_PATH=os.path.join(workdir, "history.sqlite3"),
+            ARTIFACT_STORE_PATH=os.path.join(workdir, "artifacts.sqlite3"),
+            LOG_LEVEL="WARNING",
+        )
+        env.pop("ANTHROPIC_API_KEY", None)
+        result = subprocess.run(
+            [sys.executable, "batch.py", source, target, "--workers", str(workers), "--rpm", "0", "--no-cache"],
+            cwd=HERE,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        results = {}
+        if os.path.exists(target):
+            with open(target) as f:
+                for line in f:
+                    record = json.loads(line)
+                    results[record["id"]] = record
+    return result.returncode, result.stderr, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=6, help="briefs to run (default 6)")
+    parser.add_argument("--workers", type=int, default=4, help="batch.py --workers (default 4)")
+    args = parser.parse_args()
+
+    records = briefs(args.records)
+    returncode, stderr, results = run(records, args.workers)
+    failures = []
+    if returncode:
+        failures.append(f"batch.py exited with {returncode}:\n{stderr}")
+    for record in records:
+        expected = "ok" if "answers" in record else "awaiting_answers"
+        result = results.get(record["id"])
+        if result is None:
+            failures.append(f"{record['id']}: not written")
+        elif result["status"] != expected:
+            failures.append(f"{record['id']}: {result['status']} {result.get('error', '')}".rstrip())
+        elif expected == "ok" and not result.get("final_prompt"):
+            failures.append(f"{record['id']}: empty final prompt")
+    print(f"batch.py on {len(records)} synthetic briefs: {len(results)} written, {len(failures)} problems")
+    for failure in failures:
+        print("FAIL:", failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
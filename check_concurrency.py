@@ -0,0 +1,273 @@
+"""Check the in-flight limiter, hedger, request coalescing and job scheduling.
+
+Each check runs the real code with fake models that sleep for set times, and
+fails if threads and event loops together exceed the limiter's budget or a
+cancelled wait keeps a slot, if the wrong hedged attempt wins, a hedge is sent or skipped when it
+should not be, the first chunk of a stream is held back, a coalesced stream
+is cancelled while someone still reads it or left running once nobody does,
+or the job queue lets one user's burst run ahead of another user's jobs.
+
+    python check_concurrency.py
+"""
+import asyncio
+import sys
+import threading
+import time
+
+import metrics
+import routing
+from clients import InFlightLimiter
+from routing import Hedger, Route
+from singleflight import SingleFlight
+from tasks import JobQueue, StreamTask
+
+ROUTE = Route(step="check", model="primary", backup="backup", temperature=0)
+
+
+class CheckFailed(Exception):
+    pass
+
+
+def expect(condition, message):
+    if not condition:
+        raise CheckFailed(message)
+
+
+def counter(name: str, **labels) -> float:
+    return metrics.registry.counters().get((name, tuple(sorted(labels.items()))), 0)
+
+
+def check_limiter_shared_budget():
+    limiter = InFlightLimiter(2)
+    peak = [0]
+    peak_lock = threading.Lock()
+
+    def hold(seconds: float):
+        with peak_lock:
+            peak[0] = max(peak[0], limiter.in_flight)
+        time.sleep(seconds)
+
+    def sync_caller():
+        with limiter.slot():
+            hold(0.05)
+
+    async def async_caller():
+        async with limiter.async_slot():
+            hold(0.05)
+
+    async def loop_callers():
+        await asyncio.gather(*(async_caller() for _ in range(3)))
+
+    # Three threads and two event loops of three coroutines each
+    threads = [threading.Thread(target=sync_caller) for _ in range(3)]
+    threads += [threading.Thread(target=asyncio.run, args=(loop_callers(),)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    expect(peak[0] <= 2, f"{peak[0]} requests were in flight with a budget of 2")
+
+    async def cancelled_wait():
+        with limiter.slot():
+            waiter = asyncio.ensure_future(async_caller())
+            await asyncio.sleep(0.05)
+            waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+
+    with limiter.slot():
+        asyncio.run(cancelled_wait())
+    time.sleep(0.05)
+    acquired = [limiter._semaphore.acquire(blocking=False) for _ in range(2)]
+    for ok in acquired:
+        if ok:
+            limiter._semaphore.release()
+    expect(all(acquired), "a cancelled async wait kept its slot")
+
+
+def replying(text: str, delay: float):
+    """Return a fake plain call answering `text` after `delay` seconds."""
+    def call():
+        time.sleep(delay)
+        return text
+    return call
+
+
+def streaming(text: str, delay: float, chunks: int = 3, gap: float = 0.01):
+    """Return a fake stream whose first chunk comes after `delay` seconds."""
+    def stream():
+        time.sleep(delay)
+        for i in range(chunks):
+            if i:
+                time.sleep(gap)
+            yield f"{text}{i} "
+    return stream
+
+
+def check_call_winner():
+    hedger = Hedger(workers=4)
+    hedged = counter("llm_hedged_total", step=ROUTE.step, model=ROUTE.model)
+    result = hedger.call(ROUTE, replying("primary", 0.01), replying("backup", 0), deadline=1)
+    expect(result == "primary", f"fast primary lost to {result!r}")
+    expect(counter("llm_hedged_total", step=ROUTE.step, model=ROUTE.model) == hedged, "fast primary was hedged")
+
+    wins = counter("llm_hedge_wins_total", step=ROUTE.step, model=ROUTE.backup)
+    result = hedger.call(ROUTE, replying("primary", 1), replying("backup", 0.01), deadline=0.05)
+    expect(result == "backup", f"backup lost to a slow primary: {result!r}")
+    expect(counter("llm_hedge_wins_total", step=ROUTE.step, model=ROUTE.backup) == wins + 1, "backup win not counted")
+
+
+def check_stream_winner():
+    hedger = Hedger(workers=4)
+    text = "".join(hedger.stream(ROUTE, streaming("p", 0.01), streaming("b", 0), deadline=1))
+    expect(text == "p0 p1 p2 ", f"fast primary stream lost: {text!r}")
+
+    wins = counter("llm_hedge_wins_total", step=ROUTE.step, model=ROUTE.backup)
+    text = "".join(hedger.stream(ROUTE, streaming("p", 1), streaming("b", 0.01), deadline=0.05))
+    expect(text == "b0 b1 b2 ", f"backup stream lost to a slow primary: {text!r}")
+    expect(counter("llm_hedge_wins_total", step=ROUTE.step, model=ROUTE.backup) == wins + 1, "backup win not counted")
+
+
+class SlowRecordingTask(StreamTask):
+    """A task that takes a while to record each chunk it is handed, as under load."""
+
+    def __init__(self, make_stream, owner=None):
+        def delayed():
+            for chunk in make_stream():
+                time.sleep(0.05)
+                yield chunk
+        super().__init__(delayed, owner)
+
+
+def check_stream_first_token():
+    # The first chunk must reach the caller once it is recorded, not at the
+    # hedge deadline, however long recording it takes
+    hedger = Hedger(workers=4)
+    routing.StreamTask = SlowRecordingTask
+    try:
+        started = time.monotonic()
+        chunks = hedger.stream(ROUTE, streaming("p", 0.01, chunks=2, gap=0.5), streaming("b", 0), deadline=2)
+        next(chunks)
+        elapsed = time.monotonic() - started
+        chunks.close()
+    finally:
+        routing.StreamTask = StreamTask
+    expect(elapsed < 0.5, f"first chunk took {elapsed:.2f}s against a 2s deadline")
+
+
+def check_hedge_skipped_when_saturated():
+    hedger = Hedger(workers=4)
+    limiter = InFlightLimiter(1)
+    backups = []
+
+    def backup():
+        backups.append(1)
+        return "backup"
+
+    skipped = counter("llm_hedge_skipped_total", step=ROUTE.step, model=ROUTE.model)
+    result = hedger.call(ROUTE, replying("primary", 0.3), backup, deadline=0.05, limiter=limiter)
+    expect(result == "primary" and not backups, "a backup was sent with every slot taken")
+    expect(counter("llm_hedge_skipped_total", step=ROUTE.step, model=ROUTE.model) == skipped + 1, "skipped hedge not counted")
+
+    text = "".join(hedger.stream(ROUTE, streaming("p", 0.3), lambda: iter([backup()]), deadline=0.05, limiter=limiter))
+    expect(text == "p0 p1 p2 " and not backups, "a backup stream was sent with every slot taken")
+
+
+def counting_stream(produced: list, closed: list, chunks: int = 10, gap: float = 0.02):
+    """Return a fake stream that notes each chunk it produces, and whether it was closed early."""
+    def stream():
+        try:
+            for i in range(chunks):
+                time.sleep(gap)
+                produced.append(i)
+                yield f"{i} "
+        except GeneratorExit:
+            closed.append(True)
+            raise
+    return stream
+
+
+def check_coalesced_readers():
+    flights = SingleFlight(workers=4)
+    produced, closed = [], []
+    coalesced = counter("llm_coalesced_total", step=ROUTE.step)
+    leader = flights.stream("key", counting_stream(produced, closed), step=ROUTE.step)
+    follower = flights.stream("key", counting_stream(produced, closed), step=ROUTE.step)
+    first = next(leader)
+    second = next(follower)
+    expect(first == second == "0 ", f"readers started at {first!r} and {second!r}")
+    # The leader gives up; the follower still gets the whole stream
+    leader.close()
+    text = second + "".join(follower)
+    expect(text == "".join(f"{i} " for i in range(10)), f"follower read {text!r} after the leader left")
+    expect(len(produced) == 10, f"the stream produced {len(produced)} chunks, not 10 once")
+    expect(counter("llm_coalesced_total", step=ROUTE.step) == coalesced + 1, "coalesced reader not counted")
+
+
+def check_last_reader_cancels():
+    flights = SingleFlight(workers=4)
+    produced, closed = [], []
+    readers = [flights.stream("key", counting_stream(produced, closed, gap=0.05)) for _ in range(2)]
+    for reader in readers:
+        next(reader)
+    for reader in readers:
+        reader.close()
+    time.sleep(0.2)
+    expect(closed, "the stream kept running after its last reader left")
+    expect(len(produced) < 10, f"the stream produced all {len(produced)} chunks for nobody")
+
+
+def check_owners_interleaved():
+    queue = JobQueue(workers=1, max_queued=10)
+    gate = threading.Event()
+    started = []
+
+    def job(name: str, wait: bool = False):
+        def stream():
+            started.append(name)
+            if wait:
+                gate.wait(5)
+            yield name
+        return stream
+
+    # a1 holds the only worker while both users queue up
+    jobs = [queue.submit(job("a1", wait=True), owner="a")]
+    time.sleep(0.05)
+    jobs += [queue.submit(job(name), owner="a") for name in ("a2", "a3")]
+    jobs += [queue.submit(job(name), owner="b") for name in ("b1", "b2", "b3")]
+    gate.set()
+    for queued in jobs:
+        queued.result(timeout=5)
+    expect(started == ["a1", "b1", "a2", "b2", "a3", "b3"], f"jobs started in order {started}")
+
+
+CHECKS = [
+    check_limiter_shared_budget,
+    check_call_winner,
+    check_stream_winner,
+    check_stream_first_token,
+    check_hedge_skipped_when_saturated,
+    check_coalesced_readers,
+    check_last_reader_cancels,
+    check_owners_interleaved,
+]
+
+
+def main():
+    failures = 0
+    for check in CHECKS:
+        started = time.monotonic()
+        try:
+            check()
+        except CheckFailed as exc:
+            failures += 1
+            print(f"FAIL: {check.__name__}: {exc}")
+        except Exception as exc:
+            failures += 1
+            print(f"FAIL: {check.__name__}: raised {exc!r}")
+        else:
+            print(f"  ok  {check.__name__} ({time.monotonic() - started:.2f}s)")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
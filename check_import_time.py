@@ -0,0 +1,65 @@
+"""Fail if importing the app entry point pulls in the LLM stack or gets slow.
+
+Runs `python -X importtime -c "import home"` in a fresh interpreter and checks
+that none of the heavy modules only needed by the "Generate Prompt" page were
+imported, and that the cumulative import time of `home` stays within budget.
+
+    python check_import_time.py [--budget-ms 1000] [--top 15]
+"""
+import argparse
+import re
+import subprocess
+import sys
+
+HEAVY_MODULES = ("langchain", "langchain_core", "langchain_anthropic", "langgraph", "anthropic", "main")
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def measure(module="home"):
+    """Return {module: (self_us, cumulative_us)} for a fresh import of `module`."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"import {module} failed:\n{result.stderr}")
+    timings = {}
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            timings[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="home")
+    parser.add_argument("--budget-ms", type=float, default=1000.0, help="cumulative import budget for --module")
+    parser.add_argument("--top", type=int, default=15, help="show the N slowest top-level imports")
+    args = parser.parse_args()
+
+    timings = measure(args.module)
+    total_ms = timings[args.module][1] / 1000
+    print(f"import {args.module}: {total_ms:.0f} ms (budget {args.budget_ms:.0f} ms)")
+    slowest = sorted(
+        ((name, cumulative) for name, (_, cumulative) in timings.items() if "." not in name),
+        key=lambda item: item[1],
+        reverse=True,
+    )
+    for name, cumulative in slowest[: args.top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    failures = []
+    heavy = sorted(name for name in timings if name.split(".")[0] in HEAVY_MODULES)
+    if heavy:
+        failures.append("heavy modules imported eagerly: " + ", ".join(heavy[:10]))
+    if total_ms > args.budget_ms:
+        failures.append(f"import time {total_ms:.0f} ms exceeds budget of {args.budget_ms:.0f} ms")
+    for failure in failures:
+        print("FAIL:", failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""Check that near-duplicate brief lookup tells related briefs from unrelated ones.
+
+Builds each pair of briefs below with `format_user_parameters`, as Step 1
+does, scores it the way the app looks briefs up, and fails if an unrelated
+pair reaches SUGGEST_THRESHOLD or a near-duplicate pair falls short of it.
+
+    python check_similarity.py
+"""
+import sys
+
+import similarity
+from main import brief_fields, format_user_parameters
+
+# Short briefs that only share common words, features or requirements
+UNRELATED = [
+    (("CRM", "login", "python"), ("game", "login", "python")),
+    (("todo app", "x", "y"), ("blog", "x", "y")),
+    (("A CRM for small sales teams", "login, contacts", "python, postgres"),
+     ("A multiplayer browser game", "login, chat", "python, websockets")),
+    (("A recipe sharing site", "search, login", "react"),
+     ("A habit tracker", "reminders, login", "react")),
+]
+# The same project described twice
+NEAR_DUPLICATES = [
+    (("A todo app", "lists, reminders", "flask"), ("A todo app", "lists and reminders", "flask")),
+    (("A todo list app for families", "shared lists, reminders", "flask, sqlite"),
+     ("A todo-list app for families", "shared lists and reminders", "flask + sqlite")),
+]
+
+
+def score(first, second) -> float:
+    """Return the estimated similarity of two briefs given as Step 1 field values."""
+    first, second = (brief_fields(format_user_parameters(*fields)) for fields in (first, second))
+    return similarity.similarity(similarity.signature(first), similarity.signature(second))
+
+
+def main():
+    threshold = similarity.SUGGEST_THRESHOLD
+    failures = []
+    for pairs, related in ((UNRELATED, False), (NEAR_DUPLICATES, True)):
+        for first, second in pairs:
+            value = score(first, second)
+            print(f"  {value:4.2f}  {first[0]!r} vs {second[0]!r}")
+            if (value >= threshold) != related:
+                kind = "near-duplicate" if related else "unrelated"
+                failures.append(f"{kind} briefs {first[0]!r} and {second[0]!r} scored {value:.2f} (threshold {threshold})")
+    for failure in failures:
+        print("FAIL:", failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
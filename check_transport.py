@@ -0,0 +1,82 @@
+"""Check that recorded exchanges replay as the client first read them.
+
+Records a few responses, plain, gzip-compressed and streamed, through
+`RecordTransport` and `AsyncRecordTransport` into a temporary cassette, then
+replays the cassette with `ReplayTransport` and fails unless every decoded
+body matches what the client read while recording.
+
+    python check_transport.py
+"""
+import asyncio
+import gzip
+import json
+import os
+import sys
+import tempfile
+
+import httpx
+
+import transport
+
+URL = "http://llm.test/v1/messages"
+BODY = {"type": "message", "content": [{"type": "text", "text": "recorded reply"}]}
+EVENTS = b"event: ping\ndata: {}\n\n" * 3
+
+
+def _respond(request):
+    """Stand in for the API: the request body picks the kind of response."""
+    kind = json.loads(request.content)["kind"]
+    if kind == "gzip":
+        return httpx.Response(
+            200,
+            headers={"content-type": "application/json", "content-encoding": "gzip"},
+            content=gzip.compress(json.dumps(BODY).encode("utf-8")),
+        )
+    if kind == "stream":
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=EVENTS)
+    return httpx.Response(200, json=BODY)
+
+
+async def _record_async(cassette, kind):
+    inner = httpx.MockTransport(_respond)
+    async with httpx.AsyncClient(transport=transport.AsyncRecordTransport(inner, cassette)) as client:
+        return (await client.post(URL, json={"kind": kind, "client": "async"})).content
+
+
+async def _replay_async(replay, kind):
+    async with httpx.AsyncClient(transport=transport._AsyncOffline(replay)) as client:
+        return (await client.post(URL, json={"kind": kind, "client": "async"})).content
+
+
+def main():
+    failures = []
+    with tempfile.TemporaryDirectory(prefix="check-transport-") as workdir:
+        cassette = transport.Cassette(os.path.join(workdir, "cassette.jsonl.gz"))
+        recorded = {}
+        with httpx.Client(transport=transport.RecordTransport(httpx.MockTransport(_respond), cassette)) as client:
+            for kind in ("plain", "gzip", "stream"):
+                recorded["sync", kind] = client.post(URL, json={"kind": kind, "client": "sync"}).content
+        for kind in ("plain", "gzip", "stream"):
+            recorded["async", kind] = asyncio.run(_record_async(cassette, kind))
+
+        replay = transport.ReplayTransport(transport.Cassette(cassette.path), speed=0)
+        for (mode, kind), expected in recorded.items():
+            try:
+                if mode == "sync":
+                    with httpx.Client(transport=transport._SyncOffline(replay)) as client:
+                        replayed = client.post(URL, json={"kind": kind, "client": "sync"}).content
+                else:
+                    replayed = asyncio.run(_replay_async(replay, kind))
+            except Exception as exc:
+                failures.append(f"{mode} {kind}: replay failed with {exc!r}")
+                continue
+            print(f"  {mode:<5} {kind:<6} {len(expected):4d} bytes recorded, {len(replayed):4d} replayed")
+            if replayed != expected:
+                failures.append(f"{mode} {kind}: replayed body differs from the recorded one")
+    for failure in failures:
+        print("FAIL:", failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""SQLite storage for LangGraph checkpoints, with retention.
+
+Each user's progress is saved as checkpoints of one graph thread. Only the
+latest checkpoint of a thread is ever read, so older ones are compacted away
+as new ones are written, and whole threads are dropped once idle for longer
+than the TTL or when there are more than `max_threads` of them.
+"""
+import logging
+import os
+import threading
+import time
+
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+import storage
+
+DEFAULT_PATH = os.environ.get("CHECKPOINT_PATH", os.path.join(".cache", "checkpoints.sqlite3"))
+DEFAULT_TTL = float(os.environ.get("CHECKPOINT_TTL_DAYS", 30)) * 24 * 3600
+DEFAULT_MAX_THREADS = int(os.environ.get("CHECKPOINT_MAX_THREADS", 10000))
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointStore:
+    def __init__(self, path: str = DEFAULT_PATH, ttl: float = DEFAULT_TTL, max_threads: int = DEFAULT_MAX_THREADS):
+        self.ttl = ttl
+        self.max_threads = max_threads
+        self.conn = storage.connect(path)
+        self.saver = SqliteSaver(self.conn)
+        # SqliteSaver serializes its own statements with a lock; reuse it so
+        # the maintenance queries below never interleave with them
+        self._lock = getattr(self.saver, "lock", None) or threading.Lock()
+        self.saver.setup()
+        with self._lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS thread_activity ("
+                "thread_id TEXT PRIMARY KEY, updated_at REAL NOT NULL)"
+            )
+
+    def touch(self, thread_id: str):
+        """Record activity on `thread_id` and drop all but its latest checkpoint."""
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO thread_activity (thread_id, updated_at) VALUES (?, ?)",
+                (thread_id, time.time()),
+            )
+            latest = self.conn.execute(
+                "SELECT MAX(checkpoint_id) FROM checkpoints WHERE thread_id = ?", (thread_id,)
+            ).fetchone()[0]
+            if latest is not None:
+                # Checkpoint ids are time-ordered UUIDs, so MAX is the latest
+                for table in ("checkpoints", "writes"):
+                    self.conn.execute(
+                        f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_id < ?",
+                        (thread_id, latest),
+                    )
+
+    def delete_threads(self, thread_ids):
+        with self._lock, self.conn:
+            for table in ("checkpoints", "writes", "thread_activity"):
+                self.conn.executemany(f"DELETE FROM {table} WHERE thread_id = ?", [(t,) for t in thread_ids])
+
+    def prune(self, vacuum: bool = False) -> int:
+        """Delete expired and excess threads. Returns how many were deleted."""
+        with self._lock:
+            expired = self.conn.execute(
+                "SELECT thread_id FROM thread_activity WHERE updated_at < ?",
+                (time.time() - self.ttl,),
+            ).fetchall()
+            excess = self.conn.execute(
+                "SELECT thread_id FROM thread_activity ORDER BY updated_at DESC LIMIT -1 OFFSET ?",
+                (self.max_threads,),
+            ).fetchall()
+        stale = {row[0] for row in expired + excess}
+        if stale:
+            self.delete_threads(stale)
+            logger.info("pruned %d checkpoint threads", len(stale))
+        if vacuum:
+            with self._lock:
+                self.conn.execute("VACUUM")
+        return len(stale)
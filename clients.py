@@ -0,0 +1,158 @@
+"""Pooled HTTP clients for the Anthropic API.
+
+`ChatAnthropic` builds its own `anthropic.Client` with default connection
+limits. `use_pool` swaps in clients that share one keep-alive connection pool
+per process, whichever model they are for, and `InFlightLimiter` bounds how
+many requests are outstanding at once, counting threaded and asyncio callers
+against the same budget.
+The transport underneath the pool is live, recording, replaying or synthetic
+per LLM_TRANSPORT (see transport.py).
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+
+import anthropic
+import httpx
+
+import metrics
+import transport
+
+POOL_SIZE = int(os.environ.get("LLM_POOL_SIZE", 20))
+MAX_IN_FLIGHT = int(os.environ.get("LLM_MAX_IN_FLIGHT", 8))
+CONNECT_TIMEOUT = float(os.environ.get("LLM_CONNECT_TIMEOUT", 10))
+READ_TIMEOUT = float(os.environ.get("LLM_READ_TIMEOUT", 600))
+
+
+def _limits(pool_size: int) -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=pool_size,
+        max_keepalive_connections=pool_size,
+        keepalive_expiry=60,
+    )
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+
+
+def http_client(pool_size: int = POOL_SIZE) -> httpx.Client:
+    """Return a keep-alive HTTP client with a pool of `pool_size` connections."""
+    return httpx.Client(
+        transport=transport.sync_transport(_limits(pool_size)),
+        timeout=_timeout(),
+        event_hooks={"request": [metrics.note_http_request]},
+    )
+
+
+def async_http_client(pool_size: int = POOL_SIZE) -> httpx.AsyncClient:
+    """Async counterpart of `http_client`.
+
+    Connections belong to the event loop that opened them, so share the result
+    within one long-lived loop only.
+    """
+    return httpx.AsyncClient(
+        transport=transport.async_transport(_limits(pool_size)),
+        timeout=_timeout(),
+        event_hooks={"request": [_note_http_request_async]},
+    )
+
+
+async def _note_http_request_async(request):
+    metrics.note_http_request(request)
+
+
+# The HTTP clients behind every model, one per kind and pool size
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _shared_client(make, pool_size: int):
+    with _clients_lock:
+        client = _clients.get((make, pool_size))
+        if client is None:
+            client = _clients[make, pool_size] = make(pool_size)
+        return client
+
+
+def use_pool(llm, pool_size: int = POOL_SIZE):
+    """Point `llm` (a `ChatAnthropic`) at the process's pooled sync and async HTTP clients.
+
+    The model keeps its key, base URL, retries and headers; only the transport
+    underneath changes, and it is shared with every other model given the
+    same `pool_size`. Returns `llm` for chaining.
+    """
+    params = {
+        "api_key": llm.anthropic_api_key.get_secret_value(),
+        "base_url": llm.anthropic_api_url,
+        "max_retries": llm.max_retries,
+        "default_headers": llm.default_headers,
+    }
+    # ChatAnthropic declares no public hook for the HTTP client, so the
+    # private attributes it builds at validation time are replaced directly.
+    object.__setattr__(llm, "_client", anthropic.Client(
+        http_client=_shared_client(http_client, pool_size), **params
+    ))
+    object.__setattr__(llm, "_async_client", anthropic.AsyncClient(
+        http_client=_shared_client(async_http_client, pool_size), **params
+    ))
+    return llm
+
+
+class InFlightLimiter:
+    """Bounds the number of concurrent model requests across the process.
+
+    Threads and coroutines, on any event loop, take their slots from the same
+    budget of `max_in_flight`.
+    """
+
+    def __init__(self, max_in_flight: int = MAX_IN_FLIGHT):
+        self.max_in_flight = max_in_flight
+        self._semaphore = threading.BoundedSemaphore(max_in_flight)
+        # Coroutines wait for a slot here, one at a time and in order, so
+        # their event loops are never blocked
+        self._acquirer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm-slot")
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def _enter(self):
+        with self._lock:
+            self._in_flight += 1
+
+    def _exit(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    @contextmanager
+    def slot(self):
+        """Hold one request slot for the duration of the block."""
+        with self._semaphore:
+            self._enter()
+            try:
+                yield
+            finally:
+                self._exit()
+
+    @asynccontextmanager
+    async def async_slot(self):
+        """Async counterpart of `slot`, sharing its slots."""
+        if not self._semaphore.acquire(blocking=False):
+            acquiring = asyncio.get_running_loop().run_in_executor(self._acquirer, self._semaphore.acquire)
+            try:
+                await asyncio.shield(acquiring)
+            except asyncio.CancelledError:
+                # The slot is still taken once it frees up; give it back then
+                acquiring.add_done_callback(lambda _: self._semaphore.release())
+                raise
+        self._enter()
+        try:
+            yield
+        finally:
+            self._exit()
+            self._semaphore.release()
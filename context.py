@@ -0,0 +1,148 @@
+"""Token-budgeted assembly of model inputs.
+
+An input is built from named sections with priorities. `fit` counts their
+tokens and, if the total is over budget, before anything is sent:
+
+1. drops paragraphs that repeat one present in a higher-priority section
+   (repeats within a section, or between sections of equal priority, stay);
+2. if it is still over budget, compacts whitespace in every section;
+3. if it is still over budget, trims sections from the lowest priority up,
+   keeping the start of each and marking what was cut.
+
+Tokens are counted with tiktoken's cl100k_base encoding. It is not Claude's
+tokenizer, but it tracks it closely enough for budgeting; without tiktoken (or
+its encoding files) a four-characters-per-token estimate is used instead.
+"""
+import functools
+import logging
+import os
+import re
+from typing import List, NamedTuple, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Token budgets for the human input of each step; the system prompt is fixed
+DEFAULT_BUDGETS = {"questions": 4000, "final": 12000}
+TRIM_MARKER = "\n[... {tokens} tokens trimmed ...]"
+CHARS_PER_TOKEN = 4
+
+
+class Section(NamedTuple):
+    name: str
+    text: str
+    priority: int
+    """Higher priorities are kept longest."""
+
+
+def budget_for(step: str) -> Optional[int]:
+    """Return the token budget for `step` (CONTEXT_BUDGET_<STEP> overrides), if any."""
+    value = os.environ.get(f"CONTEXT_BUDGET_{step.upper()}")
+    if value is not None:
+        return int(value) or None
+    return DEFAULT_BUDGETS.get(step)
+
+
+@functools.lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        logger.warning("tiktoken unavailable, estimating tokens from length")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    encoding = _encoding()
+    if encoding is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def _truncate(text: str, tokens: int) -> str:
+    """Return the first `tokens` tokens of `text`."""
+    encoding = _encoding()
+    if encoding is None:
+        return text[: tokens * CHARS_PER_TOKEN]
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:tokens])
+
+
+def _paragraphs(text: str) -> List[str]:
+    return re.split(r"\n\s*\n", text)
+
+
+def _normalize(paragraph: str) -> str:
+    return " ".join(paragraph.split()).lower()
+
+
+def _dedupe(sections: List[Section]) -> List[Section]:
+    """Drop each section's paragraphs that appear in a higher-priority section."""
+    # Paragraphs of the sections with a priority above the one being deduped
+    higher = set()
+    texts = {}
+    for priority in sorted({section.priority for section in sections}, reverse=True):
+        level = [section for section in sections if section.priority == priority]
+        for section in level:
+            paragraphs = _paragraphs(section.text)
+            kept = []
+            for paragraph in paragraphs:
+                key = _normalize(paragraph)
+                if key and key in higher:
+                    continue
+                kept.append(paragraph)
+            texts[section.name] = section.text if len(kept) == len(paragraphs) else "\n\n".join(kept)
+        for section in level:
+            higher.update(_normalize(paragraph) for paragraph in _paragraphs(section.text))
+    return [section._replace(text=texts[section.name]) for section in sections]
+
+
+def _compact(text: str) -> str:
+    lines = [" ".join(line.split()) for line in text.strip().splitlines()]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines))
+
+
+def fit(sections: List[Section], budget: Optional[int], step: str = "") -> List[str]:
+    """Return the section texts, in order, reduced to fit `budget` tokens in total."""
+    counts = [count_tokens(section.text) for section in sections]
+    original = total = sum(counts)
+    actions = []
+
+    if budget is not None and total > budget:
+        sections = _dedupe(sections)
+        counts = [count_tokens(section.text) for section in sections]
+        if sum(counts) < total:
+            actions.append(f"deduplicated {total - sum(counts)}")
+        total = sum(counts)
+
+    if budget is not None and total > budget:
+        sections = [section._replace(text=_compact(section.text)) for section in sections]
+        counts = [count_tokens(section.text) for section in sections]
+        actions.append(f"compacted {total - sum(counts)}")
+        total = sum(counts)
+
+    if budget is not None and total > budget:
+        order = sorted(range(len(sections)), key=lambda i: (sections[i].priority, -i))
+        for i in order:
+            excess = total - budget
+            if excess <= 0:
+                break
+            keep = max(0, counts[i] - excess - count_tokens(TRIM_MARKER.format(tokens=excess)))
+            cut = counts[i] - keep
+            text = _truncate(sections[i].text, keep) + TRIM_MARKER.format(tokens=cut)
+            sections[i] = sections[i]._replace(text=text)
+            total -= counts[i] - count_tokens(text)
+            counts[i] = count_tokens(text)
+            actions.append(f"trimmed {sections[i].name} by {cut}")
+        metrics.registry.inc("context_trimmed_total", step=step)
+
+    if actions:
+        logger.info(
+            "context[%s]: %d -> %d tokens (budget %s): %s",
+            step, original, total, budget, ", ".join(actions),
+        )
+    else:
+        logger.debug("context[%s]: %d tokens (budget %s)", step, total, budget)
+    return [section.text for section in sections]
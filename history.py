@@ -0,0 +1,239 @@
+"""Searchable history of generated prompts.
+
+Each finished run (parameters, clarifying questions, answers, final prompt,
+model and step timings) is stored in SQLite. The texts are stored as one
+zlib-compressed JSON document per run; listings only read a short title and
+metadata, and a run is decompressed when it is opened.
+
+Search uses a contentless FTS5 index over the texts, so the index adds no
+second uncompressed copy. Where SQLite lacks FTS5, search falls back to
+scanning the most recent runs. Runs older than the retention period are
+deleted.
+"""
+import json
+import logging
+import os
+import sqlite3
+import time
+import zlib
+from typing import List, NamedTuple, Optional
+
+import streamlit as st
+
+import session_store
+from storage import SQLiteStore
+
+DEFAULT_PATH = os.environ.get("HISTORY_PATH", os.path.join(".cache", "history.sqlite3"))
+DEFAULT_RETENTION = float(os.environ.get("HISTORY_RETENTION_DAYS", 90)) * 24 * 3600
+PAGE_SIZE = 10
+TEXT_FIELDS = ("user_parameters", "clarifying_questions", "user_answers", "final_prompt")
+# Runs scanned per search when FTS5 is unavailable
+SCAN_LIMIT = 500
+
+logger = logging.getLogger(__name__)
+
+
+class Summary(NamedTuple):
+    id: int
+    created_at: float
+    title: str
+    model: str
+
+
+def _title(user_parameters: str) -> str:
+    for line in user_parameters.splitlines():
+        line = line.strip()
+        if line:
+            # Drop the "{project description}:" label of the Step 2 input
+            title = line.split("}:", 1)[-1].strip()
+            return title[:120] or "Untitled"
+    return "Untitled"
+
+
+def _fts_query(query: str) -> str:
+    # Quote each term so user input is never parsed as FTS5 syntax
+    return " ".join('"' + term.replace('"', '""') + '"' for term in query.split())
+
+
+class HistoryStore(SQLiteStore):
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS runs ("
+        "id INTEGER PRIMARY KEY, owner TEXT NOT NULL, created_at REAL NOT NULL, "
+        "title TEXT NOT NULL, model TEXT NOT NULL, timings TEXT NOT NULL, data BLOB NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS runs_owner ON runs (owner, created_at)",
+    )
+
+    def __init__(self, path: str = DEFAULT_PATH, retention: float = DEFAULT_RETENTION):
+        super().__init__(path)
+        self.retention = retention
+        with self._lock, self.conn:
+            try:
+                self.conn.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS runs_fts USING fts5("
+                    + ", ".join(TEXT_FIELDS) + ", content='')"
+                )
+                self.fts = True
+            except sqlite3.OperationalError:
+                logger.warning("SQLite has no FTS5; history search scans recent runs instead")
+                self.fts = False
+
+    def add(self, owner: str, record: dict, model: str, timings: Optional[dict] = None) -> int:
+        """Store one run. `record` holds the texts named in TEXT_FIELDS."""
+        texts = {field: record.get(field, "") for field in TEXT_FIELDS}
+        data = zlib.compress(json.dumps(texts).encode("utf-8"))
+        with self._lock, self.conn:
+            run_id = self.conn.execute(
+                "INSERT INTO runs (owner, created_at, title, model, timings, data) VALUES (?, ?, ?, ?, ?, ?)",
+                (owner, time.time(), _title(texts["user_parameters"]), model, json.dumps(timings or {}), data),
+            ).lastrowid
+            if self.fts:
+                self.conn.execute(
+                    f"INSERT INTO runs_fts (rowid, {', '.join(TEXT_FIELDS)}) VALUES (?, ?, ?, ?, ?)",
+                    (run_id, *texts.values()),
+                )
+        return run_id
+
+    def get(self, owner: str, run_id: int) -> Optional[dict]:
+        """Return a run with its texts, metadata and timings."""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT id, created_at, title, model, timings, data FROM runs WHERE owner = ? AND id = ?",
+                (owner, run_id),
+            ).fetchone()
+        if row is None:
+            return None
+        run_id, created_at, title, model, timings, data = row
+        return dict(
+            json.loads(zlib.decompress(data)),
+            id=run_id, created_at=created_at, title=title, model=model, timings=json.loads(timings),
+        )
+
+    def page(self, owner: str, query: str = "", offset: int = 0, limit: int = PAGE_SIZE) -> List[Summary]:
+        """Return one page of run summaries, newest first, matching `query` if given."""
+        query = query.strip()
+        if query and not self.fts:
+            return self._scan(owner, query)[offset:offset + limit]
+        sql = "SELECT id, created_at, title, model FROM runs WHERE owner = ?"
+        params = [owner]
+        if query:
+            sql += " AND id IN (SELECT rowid FROM runs_fts WHERE runs_fts MATCH ?)"
+            params.append(_fts_query(query))
+        sql += " ORDER BY created_at DESC LIMIT ? OFFSET ?"
+        with self._lock:
+            rows = self.conn.execute(sql, params + [limit, offset]).fetchall()
+        return [Summary(*row) for row in rows]
+
+    def _scan(self, owner: str, query: str) -> List[Summary]:
+        terms = query.lower().split()
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT id, created_at, title, model, data FROM runs WHERE owner = ? "
+                "ORDER BY created_at DESC LIMIT ?",
+                (owner, SCAN_LIMIT),
+            ).fetchall()
+        matches = []
+        for run_id, created_at, title, model, data in rows:
+            text = zlib.decompress(data).decode("utf-8").lower()
+            if all(term in text for term in terms):
+                matches.append(Summary(run_id, created_at, title, model))
+        return matches
+
+    def delete(self, owner: str, run_ids) -> None:
+        with self._lock, self.conn:
+            self._delete(owner, run_ids)
+
+    def _delete(self, owner, run_ids):
+        for run_id in run_ids:
+            row = self.conn.execute(
+                "SELECT data FROM runs WHERE id = ?" + (" AND owner = ?" if owner is not None else ""),
+                (run_id,) + ((owner,) if owner is not None else ()),
+            ).fetchone()
+            if row is None:
+                continue
+            if self.fts:
+                # A contentless index needs the original values to remove a row
+                texts = json.loads(zlib.decompress(row[0]))
+                self.conn.execute(
+                    f"INSERT INTO runs_fts (runs_fts, rowid, {', '.join(TEXT_FIELDS)}) "
+                    "VALUES ('delete', ?, ?, ?, ?, ?)",
+                    (run_id, *(texts.get(field, "") for field in TEXT_FIELDS)),
+                )
+            self.conn.execute("DELETE FROM runs WHERE id = ?", (run_id,))
+
+    def prune(self) -> int:
+        """Delete runs older than the retention period. Returns how many were deleted."""
+        with self._lock, self.conn:
+            expired = [row[0] for row in self.conn.execute(
+                "SELECT id FROM runs WHERE created_at < ?", (time.time() - self.retention,)
+            )]
+            self._delete(None, expired)
+        if expired:
+            logger.info("pruned %d history runs", len(expired))
+        return len(expired)
+
+
+@st.cache_resource
+def get_history_store():
+    store = HistoryStore()
+    store.prune()
+    return store
+
+
+def history_page():
+    """Sidebar page listing the user's past prompts, with search."""
+    owner = st.session_state.get("thread_id")
+    st.title("History")
+    if owner is None:
+        st.info("History is kept per signed-in user.")
+        return
+    store = get_history_store()
+
+    query = st.text_input("Search", placeholder="Words from a brief, answer or prompt", key="history_query")
+    if query != st.session_state.get("history_last_query"):
+        st.session_state.history_last_query = query
+        st.session_state.history_offset = 0
+    offset = st.session_state.get("history_offset", 0)
+    # One extra row tells whether there is a next page
+    rows = store.page(owner, query, offset, PAGE_SIZE + 1)
+    if not rows:
+        st.caption("No matching prompts." if query else "Prompts you generate will appear here.")
+
+    for summary in rows[:PAGE_SIZE]:
+        created = time.strftime("%Y-%m-%d %H:%M", time.localtime(summary.created_at))
+        if st.button(f"{created} · {summary.title}", key=f"history_{summary.id}", use_container_width=True):
+            st.session_state.history_selected = summary.id
+
+    previous, _, following = st.columns([1, 4, 1])
+    if offset and previous.button("Newer"):
+        st.session_state.history_offset = max(0, offset - PAGE_SIZE)
+        st.rerun()
+    if len(rows) > PAGE_SIZE and following.button("Older"):
+        st.session_state.history_offset = offset + PAGE_SIZE
+        st.rerun()
+
+    # Only the selected run is decompressed and rendered
+    selected = st.session_state.get("history_selected")
+    run = store.get(owner, selected) if selected is not None else None
+    if run is None:
+        return
+    st.divider()
+    st.subheader(run["title"])
+    timings = ", ".join(f"{step} {seconds:.1f}s" for step, seconds in run["timings"].items())
+    st.caption(f"{run['model']}" + (f" · {timings}" if timings else ""))
+    with st.expander("Parameters, questions and answers"):
+        st.markdown(run["user_parameters"])
+        st.markdown(run["clarifying_questions"])
+        st.markdown(run["user_answers"])
+    st.markdown(run["final_prompt"])
+    st.download_button("Download final_prompt.md", run["final_prompt"].encode("utf-8"), "final_prompt.md", "text/markdown")
+    if st.button("Open in Generate Prompt", help="Continue from this prompt; regenerate or start over from there"):
+        # The page is about to load the LLM stack anyway
+        from main import cancel_jobs, save_session
+
+        cancel_jobs()
+        for field in TEXT_FIELDS:
+            session_store.write(field, run[field])
+        st.session_state.step = 3
+        save_session()
+        st.session_state.page = "Generate Prompt"
+        st.rerun()
@@ -1,7 +1,16 @@
 import streamlit as st
 st.set_page_config(layout="wide")
 import hmac
-from main import generate_prompt_page
+import uuid
+import logging
+import os
+import functools
+import metrics
+import profiler
+import quotas
+import session_store
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
 
 def check_password() -> bool:
     """Returns `True` if the user had a correct password."""
@@ -25,7 +34,12 @@ def check_password() -> bool:
             )
         ):
             st.session_state["password_correct"] = True
-            del st.session_state["password"]  # Don't store the username or password.
+            st.session_state["is_admin"] = st.session_state["username"] in st.secrets.get("admins", [])
+            # Stable per-user id for checkpointed progress, derived without keeping the name
+            st.session_state["thread_id"] = str(uuid.uuid5(uuid.NAMESPACE_URL, "codepromptpro:" + st.session_state["username"]))
+            # The account generations are charged to, for quotas and fair scheduling
+            st.session_state["principal"] = st.session_state["username"]
+            del st.session_state["password"]  # Don't keep the password or the login widgets' values.
             del st.session_state["username"]
         else:
             st.session_state["password_correct"] = False
@@ -40,80 +54,124 @@ def check_password() -> bool:
         st.error("😕 User not known or password incorrect")
     return False
 
+# Home page text, one markdown element per block so each rerun sends fewer
+HOW_IT_WORKS = """
+1. **Provide Initial Parameters:** Describe your project, its key features, and technical requirements
+2. **Answer Clarifying Questions:** Our AI will ask for additional details to refine the prompt
+3. **Receive Your Comprehensive Prompt:** Get a detailed, AI-generated prompt tailored to your project needs
+"""
+
+FRAMEWORK_INTRO = """
+CodePromptPro is optimized to generate prompts for full-stack web applications with the following technology stack (Framework Agnosticism in Development):
+"""
+
+STACK_LEFT = """
+### Frontend
+- **Framework:** React
+- **Language:** TypeScript
+- **Routing:** React Router
+- **State Management:** Context API or Redux
+- **Styling:** CSS Modules or Styled Components
+- **Testing:** Jest and React Testing Library
+
+### Backend
+- **Language:** Python 3.x
+- **Framework:** Flask
+- **ORM:** SQLAlchemy
+- **Serialization:** Marshmallow
+- **Testing:** Pytest
+"""
+
+STACK_RIGHT = """
+### Database
+- **PostgreSQL** (with SQLAlchemy ORM integration)
+
+### DevOps
+- **Containerization:** Docker and Docker Compose
+- **Infrastructure as Code:** Terraform (for Linode deployment)
+- **CI/CD:** GitHub Actions or Jenkins
+- **Local Development:** LocalStack for cloud service simulation
+
+### Additional Tools
+- **Environment Management:** dotenv
+- **Secrets Management:** git-crypt
+- **Code Quality:** ESLint, Prettier (Frontend), Flake8, Black (Backend)
+- **API Documentation:** Swagger/OpenAPI
+"""
+
+STACK_OUTRO = """
+This stack provides a robust foundation for building modern, scalable web applications. Our AI-generated prompts will guide you through setting up this entire ecosystem, from project structure to deployment configurations.
+"""
+
 def home_page():
     st.title("Welcome to CodePromptPro")
 
     st.markdown("""**Build a prompt for your AI-Powered IDE, even if you don't know where to start.**""")
 
     with st.expander("How It Works", expanded=True):
-        st.markdown("""
-        1. **Provide Initial Parameters:** Describe your project, its key features, and technical requirements
-        2. **Answer Clarifying Questions:** Our AI will ask for additional details to refine the prompt
-        3. **Receive Your Comprehensive Prompt:** Get a detailed, AI-generated prompt tailored to your project needs
-        """)
+        st.markdown(HOW_IT_WORKS)
 
     with st.expander("Current Framework Support", expanded=True):
-        st.markdown("""
-        CodePromptPro is optimized to generate prompts for full-stack web applications with the following technology stack (Framework Agnosticism in Development):
-        """)
+        st.markdown(FRAMEWORK_INTRO)
 
         col1, col2 = st.columns(2)
+        col1.markdown(STACK_LEFT)
+        col2.markdown(STACK_RIGHT)
 
-        with col1:
-            st.markdown("""
-            ### Frontend
-            - **Framework:** React
-            - **Language:** TypeScript
-            - **Routing:** React Router
-            - **State Management:** Context API or Redux
-            - **Styling:** CSS Modules or Styled Components
-            - **Testing:** Jest and React Testing Library
-            """)
-
-            st.markdown("""
-            ### Backend
-            - **Language:** Python 3.x
-            - **Framework:** Flask
-            - **ORM:** SQLAlchemy
-            - **Serialization:** Marshmallow
-            - **Testing:** Pytest
-            """)
-
-        with col2:
-            st.markdown("""
-            ### Database
-            - **PostgreSQL** (with SQLAlchemy ORM integration)
-            """)
-
-            st.markdown("""
-            ### DevOps
-            - **Containerization:** Docker and Docker Compose
-            - **Infrastructure as Code:** Terraform (for Linode deployment)
-            - **CI/CD:** GitHub Actions or Jenkins
-            - **Local Development:** LocalStack for cloud service simulation
-            """)
-
-            st.markdown("""
-            ### Additional Tools
-            - **Environment Management:** dotenv
-            - **Secrets Management:** git-crypt
-            - **Code Quality:** ESLint, Prettier (Frontend), Flake8, Black (Backend)
-            - **API Documentation:** Swagger/OpenAPI
-            """)
-
-    st.markdown("""
-    This stack provides a robust foundation for building modern, scalable web applications. Our AI-generated prompts will guide you through setting up this entire ecosystem, from project structure to deployment configurations.
-    """)
+    st.markdown(STACK_OUTRO)
 
     st.success("Ready to create your first prompt? Click on 'Generate Prompt' in the sidebar to get started!")
 
+def metrics_panel():
+    """Sidebar panel with model call metrics, for admins listed in st.secrets["admins"]."""
+    with st.sidebar.expander("Metrics"):
+        rows = metrics.registry.summary()
+        if rows:
+            st.dataframe(rows, hide_index=True)
+        else:
+            st.caption("No model calls yet.")
+        gauges = metrics.registry.gauges()
+        if gauges:
+            st.json(gauges, expanded=False)
+
+def usage_panel():
+    """Sidebar panel with each user's generations, tokens and remaining quota, for admins."""
+    with st.sidebar.expander("Usage"):
+        rows = quotas.manager.usage()
+        if rows:
+            st.dataframe(rows, hide_index=True)
+        else:
+            st.caption("No generations yet.")
+
+@functools.lru_cache(maxsize=8)
+def _stylesheet(paths, mtimes):
+    css = []
+    for path in paths:
+        with open(path, "r") as f:
+            css.append(f.read())
+    return "<style>" + "\n".join(css) + "</style>"
+
+def stylesheet(*paths):
+    """Return the files at `paths` as one <style> block.
+
+    The files are read once per process and again only when one changes.
+    """
+    return _stylesheet(paths, tuple(os.stat(path).st_mtime_ns for path in paths))
+
 def main():
     def load_css():
-        with open("styles.css", "r") as f:
-            st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+        st.markdown(stylesheet("styles.css"), unsafe_allow_html=True)
 
     # Call this function at the start of your app
-    load_css()
+    with profiler.section("css"):
+        load_css()
+
+    # Serve Prometheus metrics if METRICS_PORT is set (once per process)
+    metrics.serve()
+
+    # Mark this session active; sessions idle for too long give up their memory
+    with profiler.section("sessions"):
+        session_store.track()
 
     # Initialize session state for logout
     if 'logout' not in st.session_state:
@@ -123,7 +181,9 @@ def main():
         st.session_state.clear()
         st.rerun()
 
-    if not check_password():
+    with profiler.section("login"):
+        authenticated = check_password()
+    if not authenticated:
         st.stop()
 
     # Set default page to Home if not set
@@ -136,17 +196,35 @@ def main():
         st.session_state.page = "Home"
     if st.sidebar.button("Generate Prompt", key="generate_prompt", help="Generate a new prompt"):
         st.session_state.page = "Generate Prompt"
+    if st.sidebar.button("History", key="history", help="Find and reopen past prompts"):
+        st.session_state.page = "History"
     
     # Add a logout button
     if st.sidebar.button("Logout", key="logout"):
         st.session_state.logout = True
         st.rerun()
 
+    if st.session_state.get("is_admin"):
+        with profiler.section("metrics panel"):
+            metrics_panel()
+            usage_panel()
+
     # Main content
-    if st.session_state.page == "Home":
-        home_page()
-    elif st.session_state.page == "Generate Prompt":
-        generate_prompt_page()
+    with profiler.section(st.session_state.page):
+        if st.session_state.page == "Home":
+            home_page()
+        elif st.session_state.page == "Generate Prompt":
+            # Imported here so the login and home pages never pay for the LLM stack
+            from main import generate_prompt_page
+            generate_prompt_page()
+        elif st.session_state.page == "History":
+            from history import history_page
+            history_page()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Time this rerun; add ?profile=1 to the URL to see the breakdown
+    profiler.start()
+    try:
+        main()
+    finally:
+        profiler.finish()
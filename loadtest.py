@@ -0,0 +1,275 @@
+"""Concurrent-session load test for the Streamlit app.
+
+Simulated users log in and go through Steps 1-3 of the Generate Prompt page,
+each session driven by Streamlit's AppTest on its own thread, against the
+stub LLM server in stub_llm.py. All sessions share one process, like the
+sessions of one app server, so they share its cached resources, job queue,
+limiter and connection pool.
+
+AppTest installs a process-wide runtime for the length of each script run, so
+script runs are serialized here; the model calls they start run concurrently
+as they would on a server. Per-step times therefore include waiting for a
+turn to run the script, much as sessions contend for the GIL in production.
+
+Concurrency ramps through the given levels. For each level the tool reports
+completed sessions per second, p50/p95/p99 wall time per step (login, Step 2
+questions, Step 3 final prompt), errors, and peak RSS and thread count:
+
+    python loadtest.py --levels 1,5,10,20 --sessions 40 --latency 0.8
+
+Every session submits a different brief, and near-duplicate question reuse is
+turned off, so neither caching nor request coalescing hides model calls; pass
+--same-brief to measure them instead.
+By default a stub is started in-process; --base-url points at a running one.
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Keep the cache and checkpoint files out of the working tree
+_workdir = tempfile.mkdtemp(prefix="loadtest-")
+os.environ.setdefault("RESPONSE_CACHE_PATH", os.path.join(_workdir, "responses.sqlite3"))
+os.environ.setdefault("CHECKPOINT_PATH", os.path.join(_workdir, "checkpoints.sqlite3"))
+os.environ.setdefault("SIMILARITY_INDEX_PATH", os.path.join(_workdir, "briefs.sqlite3"))
+os.environ.setdefault("HISTORY_PATH", os.path.join(_workdir, "history.sqlite3"))
+os.environ.setdefault("ARTIFACT_STORE_PATH", os.path.join(_workdir, "artifacts.sqlite3"))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import stub_llm
+
+HOME = os.path.join(os.path.dirname(os.path.abspath(__file__)), "home.py")
+STEPS = ("login", "questions", "final")
+PASSWORD = "loadtest"
+
+# AppTest swaps a process-global runtime in and out around every script run
+_script_lock = threading.Lock()
+
+
+def rss_mib() -> float:
+    """Current resident set size, or the peak where /proc is unavailable."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+class Monitor:
+    """Samples RSS and thread count in the background while a level runs."""
+
+    def __init__(self, interval: float = 0.2):
+        self.interval = interval
+        self.peak_rss = self.peak_threads = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="loadtest-monitor", daemon=True)
+
+    def _run(self):
+        while True:
+            self.peak_rss = max(self.peak_rss, rss_mib())
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+            if self._stop.wait(self.interval):
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def _run(at):
+    with _script_lock:
+        at.run()
+
+
+def _wait_for(at, key, poll: float, timeout: float):
+    """Rerun the page, as the job-polling fragment would, until `key` is filled."""
+    deadline = time.perf_counter() + timeout
+    while not at.session_state[key]:
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+        if time.perf_counter() > deadline:
+            raise TimeoutError(f"timed out waiting for {key}")
+        time.sleep(poll)
+        _run(at)
+
+
+def run_session(username: str, brief: str, secrets: dict, poll: float, timeout: float) -> dict:
+    """Drive one user from login to the final prompt. Returns seconds per step."""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(HOME, default_timeout=timeout)
+    at.secrets.update(secrets)
+    timings = {}
+
+    started = time.perf_counter()
+    _run(at)
+    at.text_input(key="username").input(username)
+    at.text_input(key="password").input(PASSWORD)
+    at.button[0].click()
+    _run(at)
+    at.sidebar.button(key="generate_prompt").click()
+    _run(at)
+    timings["login"] = time.perf_counter() - started
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+
+    at.text_area[0].input(brief)
+    at.text_area[1].input("Accounts, roles, audit log, CSV export")
+    at.text_area[2].input("Flask, PostgreSQL, React")
+    started = time.perf_counter()
+    at.button[0].click()
+    _run(at)
+    _wait_for(at, "clarifying_questions", poll, timeout)
+    timings["questions"] = time.perf_counter() - started
+
+    at.text_area[0].input("About fifty users; deploy with Docker on Linode.")
+    started = time.perf_counter()
+    at.button[0].click()
+    _run(at)
+    _wait_for(at, "final_prompt", poll, timeout)
+    timings["final"] = time.perf_counter() - started
+    return timings
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def run_level(concurrency: int, sessions: int, args, secrets: dict, run_id: str) -> dict:
+    results, errors = [], []
+    lock = threading.Lock()
+
+    def session(i):
+        # A fresh user per session, so no one resumes another session's checkpoint
+        username = f"load-{run_id}-{concurrency}-{i}"
+        brief = "An internal admin dashboard" if args.same_brief else f"Dashboard #{i} for team {username}"
+        try:
+            timings = run_session(username, brief, secrets, args.poll, args.timeout)
+        except Exception as exc:
+            with lock:
+                errors.append(repr(exc))
+        else:
+            with lock:
+                results.append(timings)
+
+    rss_before = rss_mib()
+    started = time.perf_counter()
+    with Monitor() as monitor, ThreadPoolExecutor(concurrency, thread_name_prefix="loadtest") as pool:
+        list(pool.map(session, range(sessions)))
+    elapsed = time.perf_counter() - started
+
+    report = {
+        "concurrency": concurrency,
+        "sessions": sessions,
+        "completed": len(results),
+        "errors": len(errors),
+        "elapsed_s": elapsed,
+        "sessions_per_s": len(results) / elapsed if elapsed else 0.0,
+        "rss_before_mib": rss_before,
+        "rss_peak_mib": monitor.peak_rss,
+        "rss_after_mib": rss_mib(),
+        "threads_peak": monitor.peak_threads,
+        "threads_after": threading.active_count(),
+        "steps": {},
+    }
+    for step in STEPS:
+        values = [timings[step] for timings in results]
+        if values:
+            report["steps"][step] = {
+                "p50_s": statistics.median(values),
+                "p95_s": _percentile(values, 0.95),
+                "p99_s": _percentile(values, 0.99),
+            }
+    if errors:
+        report["first_error"] = errors[0]
+    return report
+
+
+def print_report(report: dict):
+    print(
+        f"concurrency {report['concurrency']}: {report['completed']}/{report['sessions']} sessions "
+        f"in {report['elapsed_s']:.1f}s ({report['sessions_per_s']:.2f}/s), {report['errors']} errors"
+    )
+    for step, stats in report["steps"].items():
+        print(f"  {step:<10} p50 {stats['p50_s']:7.2f}s  p95 {stats['p95_s']:7.2f}s  p99 {stats['p99_s']:7.2f}s")
+    print(
+        f"  rss {report['rss_before_mib']:.0f} -> {report['rss_after_mib']:.0f} MiB "
+        f"(peak {report['rss_peak_mib']:.0f}), threads peak {report['threads_peak']}, "
+        f"after {report['threads_after']}"
+    )
+    if "first_error" in report:
+        print(f"  first error: {report['first_error']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ramp concurrent sessions through the app against a stub LLM.")
+    parser.add_argument("--levels", default="1,5,10", help="comma-separated concurrency levels (default 1,5,10)")
+    parser.add_argument("--sessions", type=int, default=0, help="sessions per level (default 2x the level)")
+    parser.add_argument("--base-url", help="use a running stub instead of starting one")
+    parser.add_argument("--latency", type=float, default=0.5, help="stub seconds to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="stub output rate")
+    parser.add_argument("--output-tokens", type=int, default=200, help="stub reply length in tokens")
+    parser.add_argument("--jitter", type=float, default=0.0, help="stub latency spread as a fraction")
+    parser.add_argument("--poll", type=float, default=float(os.environ.get("JOB_POLL_INTERVAL", 0.3)),
+                        help="seconds between page reruns while a step generates")
+    parser.add_argument("--timeout", type=float, default=300, help="per-step timeout in seconds")
+    parser.add_argument("--same-brief", action="store_true", help="submit one brief from every session")
+    parser.add_argument("--json", metavar="PATH", help="also write the reports as JSON")
+    args = parser.parse_args(argv)
+
+    if args.base_url:
+        base_url = args.base_url
+    else:
+        config = stub_llm.StubConfig(args.latency, args.tokens_per_second, args.output_tokens, args.jitter)
+        server = stub_llm.serve(0, config)
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    if not args.same_brief:
+        # The briefs differ only in a number; don't let near-duplicate reuse
+        # answer Step 2 without the model
+        os.environ.setdefault("SIMILARITY_SUGGEST_THRESHOLD", "2")
+        os.environ.setdefault("SIMILARITY_SERVE_THRESHOLD", "2")
+    # Never send load-test traffic to the real API
+    os.environ["ANTHROPIC_BASE_URL"] = base_url
+    os.environ.pop("ANTHROPIC_API_KEY", None)
+
+    # The app reads styles.css and its modules relative to its directory
+    os.chdir(os.path.dirname(HOME))
+    levels = [int(level) for level in args.levels.split(",")]
+    run_id = uuid.uuid4().hex[:8]
+    users = {
+        f"load-{run_id}-{level}-{i}": PASSWORD
+        for level in levels
+        for i in range(args.sessions or 2 * level)
+    }
+    secrets = {"anthropic_api_key": "stub", "passwords": users}
+
+    reports = []
+    for level in levels:
+        report = run_level(level, args.sessions or 2 * level, args, secrets, run_id)
+        print_report(report)
+        reports.append(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
+    return 1 if any(report["errors"] for report in reports) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,31 +1,100 @@
 import os
+import re
 import uuid
 import json
+import logging
+import functools
 from typing import Optional, Annotated, TypedDict
 from langchain_anthropic import ChatAnthropic
 from langchain.prompts import ChatPromptTemplate
 from langchain.schema import StrOutputParser
 from dotenv import load_dotenv
 import streamlit as st
-import base64
 from langgraph.graph import StateGraph, END
+from langgraph.constants import Send
 from langgraph.prebuilt import ToolExecutor
 from langchain_core.tools import tool
-from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
 from langgraph.graph.message import add_messages
 from langgraph.prebuilt import ToolInvocation
+from cache import MemoryTier, ResponseCache, cache_key
+from clients import InFlightLimiter, use_pool
+from singleflight import SingleFlight
+import routing
+from tasks import JobQueue, QueueFull
+from quotas import QuotaExceeded
+import metrics
+import profiler
+import quotas
+import session_store
+import transport
+import context
+import sections
+from checkpoints import CheckpointStore
+from similarity import SimilarityIndex
+from history import get_history_store
+import similarity
 
 # Load environment variables
 # load_dotenv()
 
+logger = logging.getLogger(__name__)
 
 
+# Defaults; each step's model and temperature come from its route (routing.py)
+MODEL = routing.DEFAULT_MODEL
+TEMPERATURE = routing.DEFAULT_TEMPERATURE
+
+# Step names, used to tag metrics
+STEP_QUESTIONS = "questions"
+STEP_FINAL = "final"
+
+# The model client, chain, tool executor and compiled graph below are built
+# once per server process with st.cache_resource and shared by every session.
+
+def _anthropic_api_key():
+    try:
+        return st.secrets["anthropic_api_key"]
+    except (FileNotFoundError, KeyError):
+        # Headless runs (see batch.py) may set the key in the environment instead
+        if transport.OFFLINE:
+            # Replayed and synthetic replies never reach the API
+            return os.environ.get("ANTHROPIC_API_KEY", "offline")
+        return os.environ["ANTHROPIC_API_KEY"]
+
 # Initialize ChatAnthropic
-llm = ChatAnthropic(
-    anthropic_api_key=st.secrets["anthropic_api_key"],
-    model="claude-3-5-sonnet-20240620",
-    temperature=0.7
-)
+@st.cache_resource
+def get_llm(model=MODEL, temperature=TEMPERATURE):
+    llm = ChatAnthropic(
+        anthropic_api_key=_anthropic_api_key(),
+        model=model,
+        temperature=temperature,
+        # Allows the static system prompt to be cached on Anthropic's side
+        default_headers={"anthropic-beta": "prompt-caching-2024-07-31"},
+    )
+    return use_pool(llm)
+
+@st.cache_resource
+def get_limiter():
+    return InFlightLimiter()
+
+# Generations run as background jobs on a bounded pool shared by all sessions
+@st.cache_resource
+def get_job_queue():
+    queue = JobQueue(
+        workers=int(os.environ.get("LLM_WORKERS", 8)),
+        max_queued=int(os.environ.get("LLM_QUEUE_DEPTH", 32)),
+    )
+    metrics.registry.register_collector(
+        lambda: {f"llm_jobs_{name}": value for name, value in queue.stats().items()}
+    )
+    # Finished jobs keep their text for the retention window
+    session_store.count_shared("job_text", queue.text_bytes)
+    return queue
+
+# How often (seconds) a page polls its running job, and retries a full queue
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 0.3))
+JOB_RETRY_INTERVAL = float(os.environ.get("JOB_RETRY_INTERVAL", 2))
 
 # Define the meta-prompt template
 meta_prompt_template = '''
@@ -182,33 +251,139 @@ Use this structured approach to draft your comprehensive prompt. Make sure to:
 
 '''
 
+# The system prompt never changes between requests, so it is sent as a fixed
+# message marked as a prompt-cache breakpoint rather than as a template. Later
+# calls then read the prefix from Anthropic's cache instead of reprocessing it.
+system_message = SystemMessage(content=[{
+    "type": "text",
+    "text": meta_prompt_template.format(),
+    "cache_control": {"type": "ephemeral"},
+}])
+
 # Define the prompt template
-chain = ChatPromptTemplate.from_messages([
-    ("system", meta_prompt_template),
+prompt = ChatPromptTemplate.from_messages([
+    system_message,
     ("human", "{input}")
-]) | llm
+])
+
+def build_chain(llm):
+    """Return the meta-prompt chain on top of chat model `llm`."""
+    return prompt | llm
+
+@st.cache_resource
+def get_chain(model=MODEL, temperature=TEMPERATURE):
+    return build_chain(get_llm(model, temperature))
+
+def usage_counts(message):
+    """Return the input, output and prompt-cache token counts of a model reply.
+
+    "input" is the uncached input tokens, as the API reports them, whether the
+    reply was streamed or not.
+    """
+    usage = message.response_metadata.get("usage") or {}
+    # The API's usage fields are optional and may be present but null
+    if usage:
+        return {
+            "input": int(usage.get("input_tokens") or 0),
+            "output": int(usage.get("output_tokens") or 0),
+            "cache_read": int(usage.get("cache_read_input_tokens") or 0),
+            "cache_creation": int(usage.get("cache_creation_input_tokens") or 0),
+        }
+    # Streamed replies only carry langchain's usage_metadata, whose input
+    # count includes the cache reads and writes listed in its details
+    usage_metadata = message.usage_metadata or {}
+    details = usage_metadata.get("input_token_details") or {}
+    cache_read = int(details.get("cache_read") or 0)
+    cache_creation = int(details.get("cache_creation") or 0)
+    return {
+        "input": max(int(usage_metadata.get("input_tokens") or 0) - cache_read - cache_creation, 0),
+        "output": int(usage_metadata.get("output_tokens") or 0),
+        "cache_read": cache_read,
+        "cache_creation": cache_creation,
+    }
+
+def log_usage(message):
+    """Log token usage for a model reply, including prompt-cache reads and writes.
+
+    The input and output tokens are charged to the quota of the user the call
+    is made for.
+    """
+    counts = usage_counts(message)
+    logger.info(
+        "LLM usage: input=%(input)s output=%(output)s cache_read=%(cache_read)s cache_creation=%(cache_creation)s",
+        counts,
+    )
+    quotas.manager.charge(quotas.current(), counts["input"] + counts["output"])
+    return counts
 
 # Define the State class
-class State(TypedDict):
+class State(TypedDict, total=False):
     messages: Annotated[list, add_messages]
+    # Progress through the page, checkpointed per user so it survives
+    # reconnects and restarts
+    step: int
+    user_parameters: str
+    clarifying_questions: str
+    user_answers: str
+    final_prompt: str
+
+SESSION_FIELDS = ("step", "user_parameters", "clarifying_questions", "user_answers", "final_prompt")
 
 # Define tools
 @tool
 def generate_prompt(parameters: str, clarifying_answers: str) -> str:
     """Generate a comprehensive prompt based on user parameters and clarifying answers."""
     final_input = parameters + "\n\n" + clarifying_answers
-    return chain.invoke({"input": final_input})
+    with get_limiter().slot():
+        return get_chain().invoke({"input": final_input})
 
 tools = [generate_prompt]
 
 # Initialize ToolExecutor
-tool_executor = ToolExecutor(tools)
-
-# Bind tools to the model
-llm = llm.bind_tools(tools)
-
-# Update the call_model function
-def call_model(state):
+@st.cache_resource
+def get_tool_executor():
+    return ToolExecutor(tools)
+
+def format_user_parameters(project_description, key_features, technical_requirements):
+    """Build the Step 2 input from the Step 1 form fields, within the step's token budget."""
+    project_description, key_features, technical_requirements = context.fit([
+        context.Section("project_description", project_description, priority=3),
+        context.Section("key_features", key_features, priority=2),
+        context.Section("technical_requirements", technical_requirements, priority=2),
+    ], context.budget_for(STEP_QUESTIONS), STEP_QUESTIONS)
+    return f'''
+    {{project description}}: {project_description}
+
+    {{key features}}: {key_features}
+
+    {{technical requirements}}: {technical_requirements}
+    '''
+
+USER_PARAMETER_LABELS = re.compile(r"^\s*\{(?:project description|key features|technical requirements)\}: ?", re.MULTILINE)
+
+def format_final_input(user_parameters, clarifying_questions, user_answers):
+    """Build the Step 3 input from everything gathered in Steps 1 and 2.
+
+    The answers and parameters are what the final prompt is built from, so when
+    the input is over the step's token budget the questions are trimmed first.
+    """
+    user_parameters, clarifying_questions, user_answers = context.fit([
+        context.Section("user_parameters", user_parameters, priority=3),
+        context.Section("clarifying_questions", clarifying_questions, priority=1),
+        context.Section("user_answers", user_answers, priority=2),
+    ], context.budget_for(STEP_FINAL), STEP_FINAL)
+    return f"""
+    User Parameters:
+    {user_parameters}
+
+    Clarifying Questions and Answers:
+    {clarifying_questions}
+
+    User Answers:
+    {user_answers}
+    """
+
+def _input_text(state):
     messages = state["messages"]
     if not isinstance(messages, list):
         messages = [messages]
@@ -217,16 +392,160 @@ def call_model(state):
     human_messages = [msg.content for msg in messages if isinstance(msg, HumanMessage)]
     
     # Join all human messages into a single string
-    input_text = "\n\n".join(human_messages)
+    return "\n\n".join(human_messages)
+
+# Responses are cached on the full request, so repeats skip the round trip
+response_cache = ResponseCache()
+metrics.registry.register_collector(
+    lambda: {f"response_cache_{name}_total": value for name, value in response_cache.stats().items()}
+)
+session_store.count_shared(
+    "response_cache", lambda: sum(tier.size() for tier in response_cache.tiers if isinstance(tier, MemoryTier))
+)
+
+def _cache_key(input_text, route):
+    return cache_key(meta_prompt_template, route.model, route.temperature, input_text)
+
+# Identical requests in flight at the same time share one model call. They
+# are keyed like the cache, so a flight's result is cached before it lands.
+# Shared streams run on the flights' own pool, apart from any one reader.
+flights = SingleFlight(workers=int(os.environ.get("LLM_FLIGHT_WORKERS", 32)))
+
+# Slow requests are hedged with a second one to the route's backup model
+hedger = routing.Hedger(workers=int(os.environ.get("LLM_HEDGE_WORKERS", 16)))
+
+def route_chains(route, chain=None, backup_chain=None):
+    """Return the primary and backup chains for `route`.
+
+    An explicit `chain` also serves as the backup unless `backup_chain` is given.
+    """
+    if chain is None:
+        chain = get_chain(route.model, route.temperature)
+        backup_chain = backup_chain or get_chain(route.backup, route.temperature)
+    return chain, backup_chain or chain
+
+# Update the call_model function
+def call_model(state, use_cache=True, chain=None, limiter=None, step="agent", backup_chain=None):
+    """Run the chain on `state`. Pass `use_cache=False` to force a fresh sample.
+
+    `step` selects the route (model, temperature and backup) and tags the
+    call's metrics. `chain`, `backup_chain` and `limiter` default to the shared
+    process-wide instances for the route.
+    """
+    route = routing.route_for(step)
+    chain, backup_chain = route_chains(route, chain, backup_chain)
+    limiter = limiter or get_limiter()
+    input_text = _input_text(state)
+    key = _cache_key(input_text, route)
+    content = response_cache.get(key) if use_cache else None
     
-    # Use the chain with the meta-prompt template
-    response = chain.invoke({"input": input_text})
+    if content is None:
+        def attempt(chain, model):
+            # Use the chain with the meta-prompt template. The hedger runs
+            # this in a limiter slot, so queueing for one is not timed.
+            with metrics.record_call(step, model) as call:
+                response = chain.invoke({"input": input_text})
+                call.set_usage(log_usage(response))
+            return response.content
+
+        def invoke():
+            content = hedger.call(
+                route,
+                lambda: attempt(chain, route.model),
+                lambda: attempt(backup_chain, route.backup),
+                routing.hedge_deadline(route, "llm_call_seconds"),
+                limiter,
+            )
+            response_cache.set(key, content)
+            return content
+
+        # A fresh sample is never shared with another caller
+        content = flights.do(key, invoke, step=step, model=route.model) if use_cache else invoke()
+    else:
+        metrics.registry.inc("llm_cache_hits_total", step=step, model=route.model)
     
-    return {"messages": [AIMessage(content=response.content)]}
+    return {"messages": [AIMessage(content=content)]}
+
+async def acall_model(state, use_cache=True, chain=None, limiter=None, step="agent"):
+    """Async variant of `call_model` for callers running their own event loop.
+
+    Requests are routed like `call_model`'s but not hedged.
+    """
+    route = routing.route_for(step)
+    chain = chain or get_chain(route.model, route.temperature)
+    limiter = limiter or get_limiter()
+    input_text = _input_text(state)
+    key = _cache_key(input_text, route)
+    content = response_cache.get(key) if use_cache else None
+
+    if content is None:
+        async def invoke():
+            async with limiter.async_slot():
+                with metrics.record_call(step, route.model) as call:
+                    response = await chain.ainvoke({"input": input_text})
+                    call.set_usage(log_usage(response))
+            response_cache.set(key, response.content)
+            return response.content
+
+        content = await flights.ado(key, invoke, step=step, model=route.model) if use_cache else await invoke()
+    else:
+        metrics.registry.inc("llm_cache_hits_total", step=step, model=route.model)
+
+    return {"messages": [AIMessage(content=content)]}
+
+def stream_model(state, use_cache=True, chain=None, limiter=None, step="agent", backup_chain=None):
+    """Yield the model's reply to `state` as text chunks, as they arrive.
+
+    A cached reply is yielded in one piece. A streamed reply is only cached once
+    the stream has run to completion. Concurrent identical requests follow one
+    shared stream, and a stream slow to start is hedged (see `call_model`).
+    """
+    route = routing.route_for(step)
+    chain, backup_chain = route_chains(route, chain, backup_chain)
+    limiter = limiter or get_limiter()
+    input_text = _input_text(state)
+    key = _cache_key(input_text, route)
+    if use_cache:
+        content = response_cache.get(key)
+        if content is not None:
+            metrics.registry.inc("llm_cache_hits_total", step=step, model=route.model)
+            yield content
+            return
+
+    def attempt(chain, model):
+        # Runs in a limiter slot taken by the hedger, like call_model's
+        full = None
+        with metrics.record_call(step, model) as call:
+            for chunk in chain.stream({"input": input_text}):
+                full = chunk if full is None else full + chunk
+                if chunk.content:
+                    call.first_token()
+                    yield chunk.content
+            if full is not None:
+                call.set_usage(log_usage(full))
+        if full is not None:
+            response_cache.set(key, full.content)
+
+    def generate():
+        return hedger.stream(
+            route,
+            lambda: attempt(chain, route.model),
+            lambda: attempt(backup_chain, route.backup),
+            routing.hedge_deadline(route),
+            limiter,
+        )
+
+    stream = flights.stream(key, generate, step=step, model=route.model) if use_cache else generate()
+    try:
+        yield from stream
+    finally:
+        stream.close()
 
 # Define graph functions
 def should_continue(state):
-    messages = state["messages"]
+    messages = state.get("messages")
+    if not messages:
+        return "end"
     last_message = messages[-1]
     if not isinstance(last_message, AIMessage) or not last_message.tool_calls:
         return "end"
@@ -240,7 +559,7 @@ def call_tool(state):
         tool=tool_call.function.name,
         tool_input=json.loads(tool_call.function.arguments),
     )
-    response = tool_executor.invoke(action)
+    response = get_tool_executor().invoke(action)
     tool_message = ToolMessage(
         content=str(response),
         tool_call_id=tool_call.id,
@@ -263,8 +582,122 @@ workflow.add_conditional_edges(
 )
 workflow.add_edge("action", "agent")
 
-# Compile the graph without checkpointing
-app = workflow.compile()
+# Section-wise Step 3: one branch per section of the final prompt, run
+# concurrently, then merged in template order. Each section is an ordinary
+# cached model call, so after an answer is edited only the sections whose
+# inputs changed go to the model.
+PROMPT_SECTIONS = sections.parse_sections(meta_prompt_template)
+
+# Default of the "Generate sections in parallel" option of Step 2
+SECTIONED_DEFAULT = os.environ.get("SECTIONED_FINAL_PROMPT", "0") not in ("0", "false", "no")
+
+def _merge_texts(left, right):
+    return {**(left or {}), **(right or {})}
+
+class SectionsState(TypedDict, total=False):
+    user_parameters: str
+    clarifying_questions: str
+    user_answers: str
+    use_cache: bool
+    section: str
+    section_input: str
+    section_texts: Annotated[dict, _merge_texts]
+    final_prompt: str
+
+def plan_sections(state):
+    pairs = sections.pair_answers(state["clarifying_questions"], state["user_answers"])
+    assigned = sections.assign_answers(PROMPT_SECTIONS, pairs)
+    budget = context.budget_for(STEP_FINAL)
+    return [
+        Send("write_section", {
+            "section": section.name,
+            "use_cache": state.get("use_cache", True),
+            "section_input": sections.section_input(
+                section, state["user_parameters"], assigned[section.name], budget
+            ),
+        })
+        for section in PROMPT_SECTIONS
+    ]
+
+def write_section(state, config):
+    options = config.get("configurable", {})
+    reply = call_model(
+        {"messages": [HumanMessage(content=state["section_input"])]},
+        use_cache=state.get("use_cache", True),
+        chain=options.get("chain"),
+        backup_chain=options.get("backup_chain"),
+        limiter=options.get("limiter"),
+        step=STEP_FINAL,
+    )
+    return {"section_texts": {state["section"]: reply["messages"][0].content}}
+
+def merge_sections(state):
+    return {"final_prompt": sections.merge(PROMPT_SECTIONS, state["section_texts"])}
+
+section_workflow = StateGraph(SectionsState)
+section_workflow.add_node("write_section", write_section)
+section_workflow.add_node("merge", merge_sections)
+section_workflow.set_conditional_entry_point(plan_sections, ["write_section"])
+section_workflow.add_edge("write_section", "merge")
+section_workflow.add_edge("merge", END)
+section_app = section_workflow.compile()
+
+def stream_sections(state, use_cache=True, chain=None, limiter=None, step=STEP_FINAL, backup_chain=None):
+    """Generate the final prompt section by section and yield it once merged.
+
+    `state` holds user_parameters, clarifying_questions and user_answers. The
+    other arguments are as for `stream_model`, so either can back a job.
+    """
+    result = section_app.invoke(
+        dict(state, use_cache=use_cache),
+        {"configurable": {"chain": chain, "backup_chain": backup_chain, "limiter": limiter}},
+    )
+    yield result["final_prompt"]
+
+# Checkpoints go to a local SQLite database; old threads are pruned on startup
+@st.cache_resource
+def get_checkpoint_store():
+    store = CheckpointStore()
+    store.prune()
+    return store
+
+# Compile the graph with checkpointing
+@st.cache_resource
+def get_app():
+    return workflow.compile(checkpointer=get_checkpoint_store().saver)
+
+def _thread_config():
+    thread_id = st.session_state.get("thread_id")
+    if thread_id is None:
+        return None
+    return {"configurable": {"thread_id": thread_id}}
+
+def save_session():
+    """Checkpoint the page's progress to the user's graph thread."""
+    config = _thread_config()
+    if config is None:
+        return
+    values = {field: session_store.read(field) for field in SESSION_FIELDS if field in st.session_state}
+    get_app().update_state(config, values, as_node="agent")
+    get_checkpoint_store().touch(config["configurable"]["thread_id"])
+
+def restore_session():
+    """Load the user's last checkpointed progress into session state."""
+    config = _thread_config()
+    if config is None:
+        return
+    values = get_app().get_state(config).values
+    for field in SESSION_FIELDS:
+        if values.get(field):
+            session_store.write(field, values[field])
+
+def reset_session():
+    """Clear the user's checkpointed progress."""
+    if _thread_config() is None:
+        return
+    for field in SESSION_FIELDS:
+        st.session_state[field] = 1 if field == "step" else ""
+    save_session()
 
 # Helper functions
 def generate_verification_message(message: AIMessage) -> AIMessage:
@@ -280,7 +713,7 @@ def generate_verification_message(message: AIMessage) -> AIMessage:
 
 def stream_app_catch_tool_calls(inputs, thread) -> Optional[AIMessage]:
     tool_call_message = None
-    for event in app.stream(inputs, thread):
+    for event in get_app().stream(inputs, thread):
         if "value" in event and "messages" in event["value"]:
             message = event["value"]["messages"][-1]
             if isinstance(message, AIMessage) and message.tool_calls:
@@ -289,36 +722,188 @@ def stream_app_catch_tool_calls(inputs, thread) -> Optional[AIMessage]:
                 st.write(message.content)
     return tool_call_message
 
-def get_binary_file_downloader_html(bin_file, file_label='File'):
-    with open(bin_file, 'rb') as f:
-        data = f.read()
-    bin_str = base64.b64encode(data).decode()
-    href = f'<a href="data:application/octet-stream;base64,{bin_str}" download="{file_label}">Download {file_label}</a>'
-    return href
+# Download formats: label -> (file extension, MIME type)
+EXPORT_FORMATS = {
+    "Markdown": ("md", "text/markdown"),
+    "Plain text": ("txt", "text/plain"),
+    "JSON": ("json", "application/json"),
+}
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def export_prompt(final_prompt, fmt, user_parameters="", clarifying_questions="", user_answers=""):
+    """Return the bytes of `final_prompt` in export format `fmt`.
+
+    Memoized on the arguments, so each prompt is encoded once per format and
+    only when that format is actually requested.
+    """
+    if fmt == "JSON":
+        return json.dumps({
+            "model": routing.route_for(STEP_FINAL).model,
+            "user_parameters": user_parameters,
+            "clarifying_questions": clarifying_questions,
+            "user_answers": user_answers,
+            "final_prompt": final_prompt,
+        }, indent=2).encode("utf-8")
+    return final_prompt.encode("utf-8")
+
+# Past briefs and their clarifying questions, for reuse on near-duplicates
+@st.cache_resource
+def get_similarity_index():
+    index = SimilarityIndex()
+    metrics.registry.register_collector(lambda: {"similarity_index_entries": len(index)})
+    return index
+
+def brief_fields(user_parameters):
+    """Return the Step 1 field values in a `format_user_parameters` text, without its labels."""
+    fields = USER_PARAMETER_LABELS.split(user_parameters)[1:]
+    return [field.strip() for field in fields] if fields else [user_parameters.strip()]
+
+def similar_questions(user_parameters):
+    """Return the stored questions of this user's brief most similar to `user_parameters`, if close enough."""
+    return get_similarity_index().lookup(
+        brief_fields(user_parameters), similarity.SUGGEST_THRESHOLD, owner=st.session_state.get("principal")
+    )
 
-def generate_prompt_page():
-    st.markdown("""
-    <style>
-    .card {
-        background-color: #ffffff;
-        border-radius: 12px;
-        box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1), 0 1px 3px rgba(0, 0, 0, 0.08);
-        padding: 1.5rem;
-        margin-bottom: 2rem;
-        height: 100%;
-    }
-    .description-card {
-        margin-top: 2rem;
-    }
-    </style>
-    """, unsafe_allow_html=True)
+def remember_questions(user_parameters, clarifying_questions):
+    get_similarity_index().add(
+        brief_fields(user_parameters), clarifying_questions, owner=st.session_state.get("principal")
+    )
 
-    # Create two columns
-    col1, col2 = st.columns([1, 1])
+def record_history(final_prompt):
+    """Store the finished run in the user's prompt history."""
+    owner = st.session_state.get("thread_id")
+    if owner is None:
+        return
+    record = {field: session_store.read(field) for field in SESSION_FIELDS if field != "step"}
+    record["final_prompt"] = final_prompt
+    get_history_store().add(
+        owner, record, routing.route_for(STEP_FINAL).model, st.session_state.get("timings")
+    )
 
-    with col1:
-        # Description card on the left
-        st.markdown("""
+# Session state keys holding the id of each step's job
+JOB_KEYS = ("questions_job", "final_job")
+
+def submit_job(job_key, state, step, use_cache=True, stream=None):
+    """Start generating the reply to `state` as a background job.
+
+    `stream` produces the reply's chunks and defaults to `stream_model`. The
+    job id is kept under `job_key`. The job counts against the signed-in
+    user's quota and is scheduled fairly against other users' jobs. Returns
+    False if the user is over quota or the queue is full, keeping the reason
+    to show under `<job_key>_wait`; retries while that is set do not count
+    as further throttled requests.
+    """
+    stream = stream or stream_model
+    principal = st.session_state.get("principal")
+    if f"{job_key}_wait" in st.session_state:
+        # A retry: poll the quota without counting the request as throttled again
+        kind, retry_after = quotas.manager.wait_time(principal)
+        if kind is not None:
+            st.session_state[f"{job_key}_wait"] = _quota_message(kind, retry_after)
+            return False
+    try:
+        quotas.manager.admit(principal)
+    except QuotaExceeded as exc:
+        st.session_state[f"{job_key}_wait"] = _quota_message(exc.kind, exc.retry_after)
+        return False
+    # Resolve the shared resources on the script thread; st.cache_resource
+    # expects to be called from a script run
+    chain, backup_chain = route_chains(routing.route_for(step))
+    limiter = get_limiter()
+    try:
+        with quotas.acting_as(principal):
+            job = get_job_queue().submit(
+                lambda: stream(
+                    state, use_cache=use_cache, chain=chain, backup_chain=backup_chain, limiter=limiter, step=step
+                ),
+                owner=principal,
+            )
+    except QueueFull:
+        quotas.manager.refund(principal)
+        st.session_state[f"{job_key}_wait"] = "The server is busy. Your request will start as soon as there is room."
+        return False
+    st.session_state.pop(f"{job_key}_wait", None)
+    st.session_state[job_key] = job.id
+    return True
+
+def _quota_message(kind, retry_after):
+    return (
+        f"You have reached your {kind} quota. "
+        f"Your request will start in about {max(1, round(retry_after))} seconds."
+    )
+
+def cancel_jobs():
+    for job_key in JOB_KEYS:
+        get_job_queue().cancel(st.session_state.pop(job_key, None))
+
+def _collect_job(key, job_key, step, on_done=None):
+    """Store the text of the job under `job_key` in `key` once it has finished.
+
+    Shows the text so far and returns False while the job is still running.
+    `on_done` is called with the text of a job that succeeded.
+    """
+    job = get_job_queue().get(st.session_state.get(job_key))
+    if job is not None and not job.done:
+        st.markdown(job.text or "_Generating..._")
+        return False
+    st.session_state.pop(job_key, None)
+    if job is None or job.cancelled:
+        # Expired, lost in a restart or cancelled; the next run submits it again
+        return True
+    if job.error is not None:
+        logger.error("job for %s failed: %r", key, job.error)
+        st.session_state[f"{key}_error"] = str(job.error) or type(job.error).__name__
+    else:
+        session_store.write(key, job.text)
+        st.session_state.setdefault("timings", {})[step] = round(job.finished_at - job.submitted_at, 3)
+        save_session()
+        if on_done is not None:
+            on_done(job.text)
+    return True
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def _poll_job(key, job_key, step, on_done=None):
+    if _collect_job(key, job_key, step, on_done):
+        st.rerun()
+
+@st.fragment(run_every=JOB_RETRY_INTERVAL)
+def _retry_job(job_key, state, step, use_cache, stream):
+    if submit_job(job_key, state, step, use_cache, stream):
+        st.rerun()
+    st.warning(st.session_state.get(f"{job_key}_wait"))
+
+def follow_job(key, job_key, state, step, use_cache=True, on_done=None, stream=None):
+    """Show the reply to `state` and store it under `key` when it is ready.
+
+    The reply is generated as a background job and the script run never waits
+    on the model: a fragment polls the job, showing its text so far, and reruns
+    the page once it has finished. The job id lives in session state, so
+    reruns reattach to the same job instead of starting another call.
+    `on_done` is called with the text once the job has succeeded. `stream`
+    is as for `submit_job`.
+    """
+    error = st.session_state.get(f"{key}_error")
+    if error:
+        st.error(f"Generation failed: {error}")
+        if st.button("Try again"):
+            del st.session_state[f"{key}_error"]
+            st.rerun()
+        return
+    job = get_job_queue().get(st.session_state.get(job_key))
+    if job is None:
+        if not submit_job(job_key, state, step, use_cache, stream):
+            _retry_job(job_key, state, step, use_cache, stream)
+            return
+    elif job.done:
+        # Finished since the last poll; the text so far is only shown by _poll_job
+        _collect_job(key, job_key, step, on_done)
+        st.rerun()
+    _poll_job(key, job_key, step, on_done)
+
+@functools.lru_cache(maxsize=None)
+def description_card(step):
+    """Return the HTML of the description card with `step` marked active."""
+    return """
         <div class="card description-card">
             <p>Welcome to <strong>CodePromptPro</strong>! Please fill in the fields on the right to generate a comprehensive prompt for your application. This prompt can then be used to instruct the AI in your IDE to build your application.</p>
             <div class="step-indicator">
@@ -327,11 +912,20 @@ def generate_prompt_page():
                 <div class="step {2}">3</div>
             </div>
         </div>
-        """.format(
-            'active' if st.session_state.get('step', 1) == 1 else '',
-            'active' if st.session_state.get('step', 1) == 2 else '',
-            'active' if st.session_state.get('step', 1) == 3 else ''
-        ), unsafe_allow_html=True)
+        """.format(*('active' if step == i else '' for i in (1, 2, 3)))
+
+def generate_prompt_page():
+    # Pick up where this user left off after a reconnect, re-login or restart
+    if "step" not in st.session_state:
+        with profiler.section("restore session"):
+            restore_session()
+
+    # Create two columns
+    col1, col2 = st.columns([1, 1])
+
+    with col1:
+        # Description card on the left; its styles are in styles.css
+        st.markdown(description_card(st.session_state.get('step', 1)), unsafe_allow_html=True)
 
     with col2:
         # Initialize session state
@@ -362,67 +956,148 @@ def generate_prompt_page():
                 st.markdown('</div>', unsafe_allow_html=True)
 
             if submit_parameters:
-                st.session_state.user_parameters = f'''
-                {{project description}}: {project_description}
-
-                {{key features}}: {key_features}
-
-                {{technical requirements}}: {technical_requirements}
-                '''
+                session_store.write("user_parameters", format_user_parameters(
+                    project_description, key_features, technical_requirements
+                ))
+                cancel_jobs()
+                match = similar_questions(session_store.read("user_parameters"))
+                if match is not None and match.score >= similarity.SERVE_THRESHOLD:
+                    # A near-duplicate brief was asked these before; skip the model
+                    session_store.write("clarifying_questions", match.questions)
+                    st.session_state.questions_reused = True
+                    metrics.registry.inc("similarity_served_total")
+                else:
+                    if match is not None:
+                        st.session_state.similar_questions = (match.score, match.questions)
+                        metrics.registry.inc("similarity_suggested_total")
+                    # Start Step 2 now so it overlaps the rerun rather than following it
+                    submit_job(
+                        "questions_job",
+                        {"messages": [HumanMessage(content=session_store.read("user_parameters"))]},
+                        STEP_QUESTIONS,
+                    )
                 st.session_state.step = 2
+                save_session()
                 st.rerun()
 
         # Step 2: AI asks clarifying questions
         elif st.session_state.step == 2:
             st.subheader("Step 2: Clarifying Questions")
             
-            if not st.session_state.clarifying_questions:
-                with st.spinner("Generating clarifying questions..."):
-                    response = call_model({"messages": [HumanMessage(content=st.session_state.user_parameters)]})
-                    ai_message = response["messages"][0]
-                    st.session_state.clarifying_questions = ai_message.content
-
-            st.markdown(st.session_state.clarifying_questions)
-
-            with st.form(key="answers_form"):
-                user_answers = st.text_area('Your Answers to Clarifying Questions', placeholder='Please answer the AI\'s questions here.')
-                submit_answers = st.form_submit_button('Submit Answers')
-
-            if submit_answers:
-                st.session_state.user_answers = user_answers
-                st.session_state.step = 3
-                st.rerun()
+            if not session_store.read("clarifying_questions"):
+                suggestion = st.session_state.get("similar_questions")
+                if suggestion is not None:
+                    score, questions = suggestion
+                    st.info(f"A similar brief ({score:.0%} match) was asked these questions:")
+                    st.markdown(questions)
+                    if st.button("Use these questions"):
+                        cancel_jobs()
+                        session_store.write("clarifying_questions", questions)
+                        del st.session_state["similar_questions"]
+                        save_session()
+                        st.rerun()
+                user_parameters = session_store.read("user_parameters")
+                follow_job(
+                    "clarifying_questions",
+                    "questions_job",
+                    {"messages": [HumanMessage(content=user_parameters)]},
+                    STEP_QUESTIONS,
+                    on_done=lambda text: remember_questions(user_parameters, text),
+                )
+            else:
+                st.session_state.pop("similar_questions", None)
+                st.markdown(session_store.read("clarifying_questions"))
+                if st.session_state.get("questions_reused") and st.button(
+                    "Ask for new questions", help="These were reused from a near-identical brief"
+                ):
+                    st.session_state.clarifying_questions = ""
+                    del st.session_state["questions_reused"]
+                    st.rerun()
+
+                # Only offered once there are questions to answer
+                with st.form(key="answers_form"):
+                    user_answers = st.text_area('Your Answers to Clarifying Questions', placeholder='Please answer the AI\'s questions here.')
+                    sectioned = st.checkbox(
+                        "Generate sections in parallel",
+                        value=st.session_state.get("sectioned", SECTIONED_DEFAULT),
+                        help="Faster, and editing an answer later only regenerates the sections it affects",
+                    )
+                    submit_answers = st.form_submit_button('Submit Answers')
+
+                if submit_answers:
+                    session_store.write("user_answers", user_answers)
+                    st.session_state.sectioned = sectioned
+                    st.session_state.step = 3
+                    save_session()
+                    st.rerun()
 
         # Step 3: AI generates the comprehensive prompt
         elif st.session_state.step == 3:
             st.subheader("Step 3: Generated Comprehensive Prompt")
             
-            if not st.session_state.final_prompt:
-                with st.spinner("Generating the comprehensive prompt..."):
-                    combined_input = f"""
-                    User Parameters:
-                    {st.session_state.user_parameters}
-
-                    Clarifying Questions and Answers:
-                    {st.session_state.clarifying_questions}
-
-                    User Answers:
-                    {st.session_state.user_answers}
-                    """
-                    response = call_model({"messages": [HumanMessage(content=combined_input)]})
-                    ai_message = response["messages"][0]
-                    st.session_state.final_prompt = ai_message.content
-
-            st.markdown(st.session_state.final_prompt)
-
-            # Create a markdown file with the final prompt
-            with open("final_prompt.md", "w") as f:
-                f.write(st.session_state.final_prompt)
-
-            # Add a download button for the markdown file
-            st.markdown(get_binary_file_downloader_html("final_prompt.md", "final_prompt.md"), unsafe_allow_html=True)
+            if not session_store.read("final_prompt"):
+                if st.session_state.get("sectioned", SECTIONED_DEFAULT):
+                    state = {
+                        "user_parameters": session_store.read("user_parameters"),
+                        "clarifying_questions": session_store.read("clarifying_questions"),
+                        "user_answers": session_store.read("user_answers"),
+                    }
+                    stream = stream_sections
+                else:
+                    combined_input = format_final_input(
+                        session_store.read("user_parameters"),
+                        session_store.read("clarifying_questions"),
+                        session_store.read("user_answers"),
+                    )
+                    state = {"messages": [HumanMessage(content=combined_input)]}
+                    stream = stream_model
+                follow_job(
+                    "final_prompt",
+                    "final_job",
+                    state,
+                    STEP_FINAL,
+                    use_cache=not st.session_state.get("fresh_sample", False),
+                    on_done=record_history,
+                    stream=stream,
+                )
+            else:
+                st.session_state.pop("fresh_sample", None)
+                st.markdown(session_store.read("final_prompt"))
+
+                # Serve the download from memory; nothing is written to disk
+                export_format = st.selectbox("Download format", list(EXPORT_FORMATS))
+                extension, mime = EXPORT_FORMATS[export_format]
+                st.download_button(
+                    f"Download final_prompt.{extension}",
+                    data=export_prompt(
+                        session_store.read("final_prompt"),
+                        export_format,
+                        session_store.read("user_parameters"),
+                        session_store.read("clarifying_questions"),
+                        session_store.read("user_answers"),
+                    ),
+                    file_name=f"final_prompt.{extension}",
+                    mime=mime,
+                )
+
+                if st.button("Regenerate", help="Ask the model for a fresh version of this prompt"):
+                    st.session_state.final_prompt = ""
+                    st.session_state.fresh_sample = True
+                    st.rerun()
+
+                with st.expander("Edit answers"):
+                    with st.form(key="edit_answers_form"):
+                        edited_answers = st.text_area("Your Answers", value=session_store.read("user_answers"))
+                        update_prompt = st.form_submit_button("Update Prompt")
+                    if update_prompt and edited_answers != session_store.read("user_answers"):
+                        session_store.write("user_answers", edited_answers)
+                        st.session_state.final_prompt = ""
+                        save_session()
+                        st.rerun()
 
             if st.button("Start Over"):
+                cancel_jobs()
+                reset_session()
                 for key in list(st.session_state.keys()):
                     del st.session_state[key]
                 st.rerun()
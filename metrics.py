@@ -0,0 +1,296 @@
+"""In-process metrics for model calls.
+
+Every model call is recorded into histograms and counters labelled by step and
+model. The registry can be rendered as Prometheus text, served over HTTP
+(METRICS_PORT), and each call can also be appended to a rotating JSONL file
+(METRICS_FILE). This module only uses the standard library so the home page
+can show the debug panel without importing the LLM stack.
+"""
+import bisect
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Estimate quantile `q` by interpolating within the matching bucket."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else lower * 2 or 1.0
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+
+class Registry:
+    """Thread-safe store of labelled counters and histograms."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        if amount is None:
+            raise ValueError(f"counter {name} incremented by None")
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, buckets=LATENCY_BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def register_collector(self, collect):
+        """Add a callable returning {metric name: value} gauges, read at export time."""
+        with self._lock:
+            self._collectors.append(collect)
+
+    def histogram(self, name: str, **labels):
+        with self._lock:
+            return self._histograms.get(self._key(name, labels))
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def histograms(self):
+        with self._lock:
+            return dict(self._histograms)
+
+    def gauges(self):
+        values = {}
+        for collect in list(self._collectors):
+            try:
+                values.update(collect())
+            except Exception:
+                logger.exception("metrics collector failed")
+        return values
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for (name, labels), value in sorted(self.counters().items()):
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for (name, labels), histogram in sorted(self.histograms().items(), key=lambda item: item[0]):
+            cumulative = 0
+            for bound, n in zip(histogram.buckets, histogram.counts):
+                cumulative += n
+                lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+            lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+        for name, value in sorted(self.gauges().items()):
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Return one row per (step, model) for display."""
+        rows = {}
+
+        def row(labels):
+            base = tuple(item for item in labels if item[0] in ("model", "step"))
+            return rows.setdefault(base, dict(base))
+
+        for (name, labels), histogram in self.histograms().items():
+            if name == "llm_call_seconds":
+                row(labels).update(p50_s=histogram.quantile(0.5), p95_s=histogram.quantile(0.95))
+            elif name == "llm_ttft_seconds":
+                row(labels).update(ttft_p50_s=histogram.quantile(0.5), ttft_p95_s=histogram.quantile(0.95))
+        for (name, labels), value in self.counters().items():
+            if name.startswith("llm_"):
+                entry = row(labels)
+                key = name[len("llm_"):]
+                entry[key] = entry.get(key, 0) + value
+        return list(rows.values())
+
+
+def _labels(labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+registry = Registry()
+
+_http_requests = contextvars.ContextVar("http_requests", default=None)
+
+
+def note_http_request(request=None):
+    """httpx request hook: counts attempts so retries can be attributed to a call."""
+    counter = _http_requests.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+def _event_log():
+    path = os.environ.get("METRICS_FILE")
+    if not path:
+        return None
+    events = logging.getLogger("metrics.events")
+    if not events.handlers:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(
+            path,
+            maxBytes=int(os.environ.get("METRICS_FILE_MAX_BYTES", 10 * 1024 * 1024)),
+            backupCount=int(os.environ.get("METRICS_FILE_BACKUPS", 5)),
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        events.addHandler(handler)
+        events.setLevel(logging.INFO)
+        events.propagate = False
+    return events
+
+
+class CallRecorder:
+    """Times one model call and records it when the block exits.
+
+        with record_call("final", model) as call:
+            for chunk in stream:
+                call.first_token()
+                ...
+            call.set_usage(usage)
+    """
+
+    def __init__(self, step: str, model: str):
+        self.step = step
+        self.model = model
+        self.usage = {}
+        self.ttft = None
+        self._requests = [0]
+
+    def __enter__(self):
+        self._token = _http_requests.set(self._requests)
+        self._started = time.perf_counter()
+        return self
+
+    def first_token(self):
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self._started
+
+    def set_usage(self, usage: dict):
+        self.usage = usage
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self._started
+        try:
+            _http_requests.reset(self._token)
+        except ValueError:
+            # A streaming generator closed from a different context than the
+            # one it started in; that context's counter is simply left behind.
+            pass
+        if exc_type is None:
+            status = "ok"
+        elif exc_type is GeneratorExit:
+            status = "cancelled"
+        else:
+            status = "error"
+        labels = {"step": self.step, "model": self.model}
+        retries = max(0, self._requests[0] - 1)
+
+        registry.inc("llm_calls_total", status=status, **labels)
+        if retries:
+            registry.inc("llm_retries_total", retries, **labels)
+        if status == "ok":
+            registry.observe("llm_call_seconds", wall, **labels)
+            if self.ttft is not None:
+                registry.observe("llm_ttft_seconds", self.ttft, **labels)
+            for kind, count in self.usage.items():
+                registry.inc(f"llm_{kind}_tokens_total", count, **labels)
+                if kind in ("input", "output"):
+                    registry.observe(f"llm_{kind}_tokens", count, buckets=TOKEN_BUCKETS, **labels)
+        elif status == "error":
+            registry.inc("llm_errors_total", error=exc_type.__name__, **labels)
+
+        events = _event_log()
+        if events is not None:
+            events.info(json.dumps({
+                "ts": time.time(),
+                "step": self.step,
+                "model": self.model,
+                "status": status,
+                "wall_s": round(wall, 4),
+                "ttft_s": None if self.ttft is None else round(self.ttft, 4),
+                "retries": retries,
+                "error": None if exc_type in (None, GeneratorExit) else exc_type.__name__,
+                **{f"{kind}_tokens": count for kind, count in self.usage.items()},
+            }))
+        return False
+
+
+def record_call(step: str, model: str) -> CallRecorder:
+    return CallRecorder(step, model)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("", "/metrics"):
+            self.send_error(404)
+            return
+        body = registry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def serve(port=None):
+    """Serve /metrics in Prometheus text format on `port` (default METRICS_PORT).
+
+    Does nothing if no port is configured or a server is already running.
+    """
+    global _server
+    port = port or os.environ.get("METRICS_PORT")
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer(("0.0.0.0", int(port)), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+            logger.info("serving metrics on port %s", port)
+    return _server
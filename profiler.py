@@ -0,0 +1,82 @@
+"""Timing breakdown of each script rerun.
+
+Streamlit reruns the whole script on every interaction, so whatever a rerun
+does unconditionally is paid on every click by every session. `section`
+times a part of the rerun into the `rerun_section_seconds` histogram and
+`finish` records the total as `rerun_seconds`, so regressions show up in the
+metrics. With `?profile=1` in the URL the current rerun's breakdown is also
+shown in the sidebar.
+
+home.py wraps every rerun in `start` and `finish`, including reruns of the
+login and home pages, which is why main.py's heavy imports stay out of here.
+"""
+import contextlib
+import contextvars
+import time
+
+import streamlit as st
+
+import metrics
+
+QUERY_PARAM = "profile"
+RERUN_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+# The profile of the rerun running on this script thread
+_current = contextvars.ContextVar("rerun_profile", default=None)
+
+
+class RerunProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        # (start offset, name, seconds, nesting depth) per finished section
+        self.sections = []
+        self.depth = 0
+
+
+def start() -> RerunProfile:
+    """Begin profiling a rerun. Call first thing in the script."""
+    profile = RerunProfile()
+    _current.set(profile)
+    return profile
+
+
+@contextlib.contextmanager
+def section(name: str):
+    """Time the enclosed part of the rerun as `name`. Sections may nest."""
+    profile = _current.get()
+    started = time.perf_counter()
+    depth = 0
+    if profile is not None:
+        depth = profile.depth
+        profile.depth += 1
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.registry.observe("rerun_section_seconds", elapsed, buckets=RERUN_BUCKETS, section=name)
+        if profile is not None:
+            profile.depth -= 1
+            profile.sections.append((started - profile.started, name, elapsed, depth))
+
+
+def enabled() -> bool:
+    return st.query_params.get(QUERY_PARAM, "0") not in ("", "0", "false")
+
+
+def finish():
+    """Record the rerun's total time, and show its breakdown if profiling is on."""
+    profile = _current.get()
+    if profile is None:
+        return
+    _current.set(None)
+    total = time.perf_counter() - profile.started
+    metrics.registry.observe("rerun_seconds", total, buckets=RERUN_BUCKETS)
+    if not enabled():
+        return
+    lines = [
+        f"{'  ' * depth}{name:<{24 - 2 * depth}} {elapsed * 1000:8.1f} ms"
+        for _, name, elapsed, depth in sorted(profile.sections)
+    ]
+    lines.append(f"{'total':<24} {total * 1000:8.1f} ms")
+    with st.sidebar.expander("Rerun profile", expanded=True):
+        st.code("\n".join(lines), language=None)
@@ -0,0 +1,199 @@
+"""Per-user quotas on model requests and tokens.
+
+Every signed-in user (the "principal", the username they logged in with) has
+two token buckets: one of generations, taken when a Step 2 or Step 3 job is
+submitted, and one of model tokens, charged with each call's actual input and
+output tokens once it returns. A bucket refills continuously at its rate up to
+its burst size. A job is refused while the user's generation bucket is empty
+or their token bucket is in debt, with the time until that clears.
+
+Calls are charged to the principal in `current()`, which jobs carry into
+their worker threads (see `acting_as`). The limits are set with
+QUOTA_REQUESTS_PER_MINUTE, QUOTA_REQUEST_BURST, QUOTA_TOKENS_PER_MINUTE and
+QUOTA_TOKEN_BURST; a rate of 0 turns that limit off. Admins see every
+user's `usage()` in a panel on the home page.
+"""
+import contextlib
+import contextvars
+import os
+import threading
+import time
+from typing import Optional, Tuple
+
+import metrics
+
+_principal = contextvars.ContextVar("principal", default=None)
+
+
+class QuotaExceeded(Exception):
+    """Raised when a principal has used up a quota. `retry_after` is in seconds."""
+
+    def __init__(self, kind: str, retry_after: float):
+        super().__init__(f"{kind} quota exceeded; retry in {retry_after:.0f}s")
+        self.kind = kind
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Holds up to `burst` units and refills at `rate` units per second.
+
+    `charge` may take the level below zero; the debt is repaid by refilling.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.level = burst
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.burst, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def available(self) -> float:
+        self._refill()
+        return self.level
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units are available."""
+        self._refill()
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def charge(self, amount: float):
+        self._refill()
+        self.level -= amount
+
+
+class QuotaManager:
+    """Thread-safe generation and token buckets per principal."""
+
+    def __init__(
+        self,
+        requests_per_minute: float = 0,
+        request_burst: float = 0,
+        tokens_per_minute: float = 0,
+        token_burst: float = 0,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.request_burst = request_burst or requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.token_burst = token_burst or tokens_per_minute
+        self._lock = threading.Lock()
+        self._requests = {}
+        self._tokens = {}
+        self._totals = {}
+
+    @classmethod
+    def from_env(cls) -> "QuotaManager":
+        return cls(
+            requests_per_minute=float(os.environ.get("QUOTA_REQUESTS_PER_MINUTE", 6)),
+            request_burst=float(os.environ.get("QUOTA_REQUEST_BURST", 20)),
+            tokens_per_minute=float(os.environ.get("QUOTA_TOKENS_PER_MINUTE", 20000)),
+            token_burst=float(os.environ.get("QUOTA_TOKEN_BURST", 100000)),
+        )
+
+    def _buckets(self, principal):
+        if principal not in self._totals:
+            if self.requests_per_minute:
+                self._requests[principal] = TokenBucket(self.requests_per_minute / 60, self.request_burst)
+            if self.tokens_per_minute:
+                self._tokens[principal] = TokenBucket(self.tokens_per_minute / 60, self.token_burst)
+            self._totals[principal] = {"requests": 0, "tokens": 0, "throttled": 0}
+        return self._requests.get(principal), self._tokens.get(principal), self._totals[principal]
+
+    @staticmethod
+    def _wait(requests, tokens) -> Tuple[Optional[str], float]:
+        # Called with the lock held
+        wait = 0.0
+        kind = None
+        if tokens is not None and tokens.wait_time(0) > wait:
+            wait, kind = tokens.wait_time(0), "token"
+        if requests is not None and requests.wait_time(1) > wait:
+            wait, kind = requests.wait_time(1), "request"
+        return kind, wait
+
+    def wait_time(self, principal: Optional[str]) -> Tuple[Optional[str], float]:
+        """Return the quota `principal` would exceed now and the seconds until it clears.
+
+        The kind is None if a generation would be admitted. Unlike `admit`,
+        this takes nothing and counts nothing, so it is safe to poll.
+        """
+        if principal is None:
+            return None, 0.0
+        with self._lock:
+            requests, tokens, _ = self._buckets(principal)
+            return self._wait(requests, tokens)
+
+    def admit(self, principal: Optional[str]):
+        """Take one generation from `principal`'s quota, or raise `QuotaExceeded`.
+
+        Anonymous callers (no principal) are not limited.
+        """
+        if principal is None:
+            return
+        with self._lock:
+            requests, tokens, totals = self._buckets(principal)
+            kind, wait = self._wait(requests, tokens)
+            if kind is not None:
+                totals["throttled"] += 1
+            else:
+                if requests is not None:
+                    requests.charge(1)
+                totals["requests"] += 1
+        if kind is not None:
+            metrics.registry.inc("quota_throttled_total", kind=kind)
+            raise QuotaExceeded(kind, wait)
+
+    def refund(self, principal: Optional[str]):
+        """Give back a generation taken by `admit` for a job that never started."""
+        if principal is None:
+            return
+        with self._lock:
+            requests, _, totals = self._buckets(principal)
+            if requests is not None:
+                requests.charge(-1)
+            totals["requests"] -= 1
+
+    def charge(self, principal: Optional[str], tokens: int):
+        """Charge `tokens` model tokens to `principal`."""
+        if principal is None or not tokens:
+            return
+        with self._lock:
+            _, bucket, totals = self._buckets(principal)
+            if bucket is not None:
+                bucket.charge(tokens)
+            totals["tokens"] += tokens
+
+    def usage(self):
+        """Return one row per principal: totals so far and what is left now."""
+        with self._lock:
+            rows = []
+            for principal, totals in sorted(self._totals.items()):
+                row = {"user": principal, **totals}
+                if principal in self._requests:
+                    row["requests_left"] = int(self._requests[principal].available())
+                if principal in self._tokens:
+                    row["tokens_left"] = int(self._tokens[principal].available())
+                rows.append(row)
+            return rows
+
+
+manager = QuotaManager.from_env()
+
+
+def current() -> Optional[str]:
+    """The principal model calls on this thread are charged to."""
+    return _principal.get()
+
+
+@contextlib.contextmanager
+def acting_as(principal: Optional[str]):
+    """Charge model calls in the block, and in jobs it starts, to `principal`."""
+    token = _principal.set(principal)
+    try:
+        yield
+    finally:
+        _principal.reset(token)
@@ -0,0 +1,226 @@
+"""Per-step model routes and latency-hedged requests.
+
+Each step is routed to a primary model and a backup model, configured with
+environment variables:
+
+    LLM_MODEL_QUESTIONS=claude-3-haiku-20240307
+    LLM_BACKUP_MODEL_QUESTIONS=claude-3-5-sonnet-20240620
+    LLM_TEMPERATURE_FINAL=0.5
+
+The backup defaults to the primary, which still helps: a slow request is
+usually slow because of the replica or connection it landed on.
+
+Step 2 defaults to Claude 3 Haiku. Its prompt cache only takes prefixes of
+2048 tokens or more, and the meta system prompt is about 1.3k, so Step 2 runs
+without prompt caching (see main.system_message). Haiku's uncached input
+still costs less than Sonnet's cached reads, and it answers sooner; set
+LLM_MODEL_QUESTIONS to a Sonnet model to keep the cached prefix instead.
+
+A hedged request goes to the primary first. If it has not answered by the
+deadline, or fails, the same request goes to the backup and whichever answers
+first wins; the other is cancelled. The deadline is the route's recorded p95
+(time to first token for streams, total time for plain calls), so only the
+slowest few percent of requests are hedged. Until a route has enough samples
+a fixed deadline is used.
+
+Each attempt runs in a slot of the process's in-flight limiter, and both the
+deadline and the recorded timings start once the slot is held, so time spent
+queueing locally is not mistaken for a slow provider. A request that reaches
+its deadline while every slot is taken is not hedged: the backup would only
+queue behind it and add to the load.
+"""
+import contextlib
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Iterator, NamedTuple, Optional
+
+import metrics
+from tasks import StreamTask
+
+DEFAULT_MODEL = "claude-3-5-sonnet-20240620"
+DEFAULT_TEMPERATURE = 0.7
+# Step 2 only asks a few questions, so it gets the small, fast model, at the
+# cost of prompt caching (see above)
+DEFAULT_MODELS = {"questions": "claude-3-haiku-20240307"}
+
+HEDGE = os.environ.get("LLM_HEDGE", "1") not in ("0", "false", "no")
+HEDGE_MIN_SAMPLES = int(os.environ.get("LLM_HEDGE_MIN_SAMPLES", 20))
+HEDGE_DEFAULT_DEADLINE = float(os.environ.get("LLM_HEDGE_DEADLINE", 10))
+HEDGE_MIN_DEADLINE = float(os.environ.get("LLM_HEDGE_MIN_DEADLINE", 1))
+
+
+class Route(NamedTuple):
+    step: str
+    model: str
+    backup: str
+    temperature: float
+
+
+def route_for(step: str) -> Route:
+    """Return the configured route for `step`."""
+    suffix = step.upper()
+    model = os.environ.get(f"LLM_MODEL_{suffix}", DEFAULT_MODELS.get(step, DEFAULT_MODEL))
+    return Route(
+        step=step,
+        model=model,
+        backup=os.environ.get(f"LLM_BACKUP_MODEL_{suffix}", model),
+        temperature=float(os.environ.get(f"LLM_TEMPERATURE_{suffix}", DEFAULT_TEMPERATURE)),
+    )
+
+
+def hedge_deadline(route: Route, metric: str = "llm_ttft_seconds") -> Optional[float]:
+    """Return how long to wait on the primary before hedging, or None to never hedge."""
+    if not HEDGE:
+        return None
+    histogram = metrics.registry.histogram(metric, step=route.step, model=route.model)
+    if histogram is None or histogram.count < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_DEADLINE
+    return max(HEDGE_MIN_DEADLINE, histogram.quantile(0.95))
+
+
+def _slot(limiter):
+    return limiter.slot() if limiter is not None else contextlib.nullcontext()
+
+
+def _saturated(limiter) -> bool:
+    return limiter is not None and limiter.in_flight >= limiter.max_in_flight
+
+
+def _in_slot(limiter, fn: Callable, admitted: threading.Event):
+    with _slot(limiter):
+        admitted.set()
+        return fn()
+
+
+class Hedger:
+    """Runs hedged requests on a pool of worker threads.
+
+    `limiter` (a `clients.InFlightLimiter`) gives each attempt its slot; see
+    the module docstring.
+    """
+
+    def __init__(self, workers: int = 16):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm-hedge")
+
+    def call(self, route: Route, primary: Callable, backup: Callable, deadline: Optional[float], limiter=None):
+        """Return the result of `primary()`, or of `backup()` if it answers first."""
+        if deadline is None:
+            with _slot(limiter):
+                return primary()
+        admitted = threading.Event()
+        futures = [self._executor.submit(contextvars.copy_context().run, _in_slot, limiter, primary, admitted)]
+        admitted.wait()
+        done, _ = wait(futures, timeout=deadline)
+        if done and futures[0].exception() is None:
+            return futures[0].result()
+        if done or not self._saturated(route, limiter):
+            self._hedged(route)
+            futures.append(self._executor.submit(
+                contextvars.copy_context().run, _in_slot, limiter, backup, threading.Event()
+            ))
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in futures:
+                if future in done and future.exception() is None:
+                    if future is not futures[0]:
+                        metrics.registry.inc("llm_hedge_wins_total", step=route.step, model=route.backup)
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+        # Both failed; report the primary's error
+        return futures[0].result()
+
+    def stream(
+        self,
+        route: Route,
+        primary: Callable[[], Iterator[str]],
+        backup: Callable[[], Iterator[str]],
+        deadline: Optional[float],
+        limiter=None,
+    ) -> Iterator[str]:
+        """Yield the chunks of `primary()`, or of `backup()` if its first chunk comes first."""
+        if deadline is None:
+            with _slot(limiter):
+                yield from primary()
+            return
+        changed = threading.Event()
+        admitted = threading.Event()
+
+        def watched(make_stream, admitted):
+            def stream():
+                try:
+                    with _slot(limiter):
+                        admitted.set()
+                        changed.set()
+                        for i, chunk in enumerate(make_stream()):
+                            yield chunk
+                            # The task records a chunk before asking for the
+                            # next, so signal only now that it shows in task.text
+                            if i == 0:
+                                changed.set()
+                finally:
+                    changed.set()
+            return stream
+
+        tasks = [StreamTask(watched(primary, admitted)).start(self._executor)]
+        started = None
+        winner = None
+        try:
+            while winner is None:
+                # Clear before checking, so a change after the check is not missed
+                changed.clear()
+                if started is None and admitted.is_set():
+                    started = time.monotonic()
+                for task in tasks:
+                    if task.text or (task.done and task.error is None):
+                        winner = task
+                        break
+                else:
+                    late = (
+                        deadline is not None and started is not None
+                        and time.monotonic() - started >= deadline
+                    )
+                    if late and self._saturated(route, limiter):
+                        # A backup would only queue behind the primary; wait on it alone
+                        deadline = None
+                        late = False
+                    if len(tasks) == 1 and (tasks[0].done or late):
+                        self._hedged(route)
+                        tasks.append(StreamTask(watched(backup, threading.Event())).start(self._executor))
+                    elif all(task.done for task in tasks):
+                        break
+                    elif len(tasks) == 1 and started is not None and deadline is not None:
+                        changed.wait(deadline - (time.monotonic() - started))
+                    else:
+                        changed.wait()
+        finally:
+            for task in tasks:
+                if task is not winner:
+                    task.cancel()
+        if winner is None:
+            # Both failed; report the primary's error
+            winner = tasks[0]
+        elif winner is not tasks[0]:
+            metrics.registry.inc("llm_hedge_wins_total", step=route.step, model=route.backup)
+        chunks = winner.chunks()
+        try:
+            yield from chunks
+        finally:
+            chunks.close()
+            winner.cancel()
+
+    @staticmethod
+    def _hedged(route: Route):
+        metrics.registry.inc("llm_hedged_total", step=route.step, model=route.model)
+
+    @staticmethod
+    def _saturated(route: Route, limiter) -> bool:
+        """Whether `limiter` has no free slot, counting a skipped hedge if so."""
+        if not _saturated(limiter):
+            return False
+        metrics.registry.inc("llm_hedge_skipped_total", step=route.step, model=route.model)
+        return True
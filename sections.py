@@ -0,0 +1,119 @@
+"""Splitting the final prompt into sections that can be generated independently.
+
+The sections are the blocks of the meta-prompt's <requirements>, plus an
+overview. Each section is written from the user parameters and only the
+clarifying questions and answers that concern it, so its input, and with it
+its cache key, changes only when something relevant to it does. An answer is
+assigned to the sections whose keywords appear in it or in its question;
+answers that match no section go to the overview.
+"""
+import re
+from typing import Dict, List, NamedTuple, Tuple
+
+import context
+
+SEPARATOR = "\n\n---\n\n"
+
+KEYWORDS = {
+    "frontend": ("frontend", "ui", "ux", "react", "typescript", "page", "pages", "screen", "component",
+                 "css", "style", "design", "browser", "mobile", "responsive", "dashboard"),
+    "backend": ("backend", "api", "endpoint", "flask", "server", "auth", "authentication", "login",
+                "permission", "permissions", "role", "roles", "integration", "webhook", "email", "python"),
+    "database": ("database", "data", "postgres", "postgresql", "sql", "schema", "table", "tables",
+                 "storage", "migration", "migrations", "records"),
+    "containerization": ("docker", "dockerfile", "container", "containers", "compose", "image"),
+    "infrastructure": ("terraform", "linode", "cloud", "infrastructure", "hosting", "host", "deploy",
+                       "deployment", "scale", "scaling", "region", "localstack"),
+    "environment_management": ("environment", "env", "dotenv", "secret", "secrets", "config",
+                               "configuration", "credential", "credentials"),
+    "makefile": ("makefile", "make", "build", "command", "commands", "script", "scripts"),
+    "additional_requirements": ("ci", "cd", "pipeline", "github actions", "jenkins", "test", "tests",
+                                "testing", "documentation", "docs", "swagger", "openapi", "logging",
+                                "errors", "lint", "linting", "seed", "sample data", "git"),
+}
+
+
+class PromptSection(NamedTuple):
+    name: str
+    title: str
+    spec: str
+    """What the meta-prompt requires of this section."""
+
+
+OVERVIEW = PromptSection(
+    "overview",
+    "Overview",
+    "A summary of the application, its users and key features, and the complete folder structure.",
+)
+
+
+def parse_sections(template: str) -> List[PromptSection]:
+    """Return the overview followed by the <requirements> blocks of `template`, in order."""
+    match = re.search(r"<requirements>(.*?)</requirements>", template, re.S)
+    blocks = re.findall(r"<(\w+)>\n(.*?)\n</\1>", match.group(1) if match else "", re.S)
+    return [OVERVIEW] + [
+        PromptSection(name, name.replace("_", " ").title(), body.strip()) for name, body in blocks
+    ]
+
+
+def split_items(text: str) -> List[str]:
+    """Split numbered or bulleted items, or failing that paragraphs, out of `text`."""
+    items = re.split(r"(?m)^\s*(?:\d+[.)]|[-*•])\s+", text)
+    if len(items) <= 1:
+        items = re.split(r"\n\s*\n", text)
+    return [item.strip() for item in items if item.strip()]
+
+
+def pair_answers(clarifying_questions: str, user_answers: str) -> List[Tuple[str, str]]:
+    """Pair each answer with its question, by position, where the counts agree."""
+    questions = [item for item in split_items(clarifying_questions) if "?" in item]
+    answers = split_items(user_answers)
+    if len(questions) != len(answers):
+        questions = [""] * len(answers)
+    return list(zip(questions, answers))
+
+
+def _mentions(text: str, keywords) -> bool:
+    text = text.lower()
+    return any(re.search(r"\b" + re.escape(keyword) + r"\b", text) for keyword in keywords)
+
+
+def assign_answers(sections: List[PromptSection], pairs: List[Tuple[str, str]]) -> Dict[str, List[Tuple[str, str]]]:
+    """Return, for each section name, the question and answer pairs that concern it."""
+    assigned = {section.name: [] for section in sections}
+    for question, answer in pairs:
+        names = [
+            section.name for section in sections
+            if _mentions(question + "\n" + answer, KEYWORDS.get(section.name, ()))
+        ]
+        for name in names or [OVERVIEW.name]:
+            assigned[name].append((question, answer))
+    return assigned
+
+
+def section_input(section: PromptSection, user_parameters: str, pairs: List[Tuple[str, str]], budget=None) -> str:
+    """Build the model input for one section, within `budget` tokens."""
+    answers = "\n\n".join(
+        (f"Q: {question}\n" if question else "") + f"A: {answer}" for question, answer in pairs
+    ) or "None beyond the parameters above."
+    user_parameters, answers = context.fit([
+        context.Section("user_parameters", user_parameters, priority=3),
+        context.Section("answers", answers, priority=2),
+    ], budget, f"section:{section.name}")
+    return f"""
+    User Parameters:
+    {user_parameters}
+
+    Clarifying Questions and Answers for this section:
+    {answers}
+
+    Write only the "{section.title}" section of the comprehensive prompt. It must cover:
+    {section.spec}
+
+    Start with the heading "## {section.title}" and do not write any other section.
+    """
+
+
+def merge(sections: List[PromptSection], texts: Dict[str, str]) -> str:
+    """Join the generated sections in template order."""
+    return SEPARATOR.join(texts[section.name].strip() for section in sections if texts.get(section.name))
@@ -0,0 +1,312 @@
+"""Bounded per-session memory.
+
+Every open tab keeps its brief, questions, answers and final prompt in session
+state, which would grow the server's memory with every tab ever opened. This
+module keeps that in check:
+
+- Texts longer than INLINE_LIMIT are stored zlib-compressed in SQLite, keyed
+  by their digest, and session state only holds a small `Handle`. Recently
+  read texts are kept decompressed in a cache of at most CACHE_BYTES.
+- Each script run records the session as seen. A session not seen for
+  SESSION_IDLE_TTL seconds has its page fields dropped; progress is
+  checkpointed per user, so the page restores it on the next visit.
+- When the memory held for sessions exceeds SESSION_MEMORY_CEILING (MiB),
+  the least recently seen sessions are evicted early, as long as they have
+  been idle for at least MIN_IDLE seconds. That memory is every session's
+  page fields, measured when the sweep runs, plus what the process holds on
+  their behalf and registers with `count_shared`: the artifact cache here,
+  and the job queue's texts and the in-memory response cache in main.py.
+  The download cache (`main.export_prompt`) is bounded by its entry count
+  and not measured.
+
+Read and write the page's texts with `read` and `write` rather than through
+`st.session_state` directly. home.py calls `track` at the top of every run,
+whichever page is open.
+"""
+import hashlib
+import logging
+import os
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Callable, Dict, NamedTuple
+
+import streamlit as st
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+import metrics
+from storage import SQLiteStore
+
+DEFAULT_PATH = os.environ.get("ARTIFACT_STORE_PATH", os.path.join(".cache", "artifacts.sqlite3"))
+# Artifacts not read or written for this long are deleted
+DEFAULT_RETENTION = float(os.environ.get("ARTIFACT_RETENTION_DAYS", 7)) * 24 * 3600
+INLINE_LIMIT = int(os.environ.get("SESSION_INLINE_LIMIT", 1024))
+CACHE_BYTES = int(float(os.environ.get("ARTIFACT_CACHE_MB", 16)) * 1024 * 1024)
+IDLE_TTL = float(os.environ.get("SESSION_IDLE_TTL", 1800))
+MEMORY_CEILING = int(float(os.environ.get("SESSION_MEMORY_CEILING", 128)) * 1024 * 1024)
+MIN_IDLE = 60
+SWEEP_INTERVAL = 30
+
+# The page state dropped from an idle session; restore_session reloads it
+EVICTABLE_FIELDS = (
+    "step", "user_parameters", "clarifying_questions", "user_answers", "final_prompt",
+    "similar_questions", "questions_reused", "timings",
+)
+
+logger = logging.getLogger(__name__)
+
+
+class Handle(NamedTuple):
+    """Stands in session state for a text kept in the `ArtifactStore`."""
+    digest: str
+    size: int
+
+
+class ArtifactStore(SQLiteStore):
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS artifacts ("
+        "digest TEXT PRIMARY KEY, size INTEGER NOT NULL, data BLOB NOT NULL, used_at REAL NOT NULL)",
+    )
+
+    def __init__(self, path: str = DEFAULT_PATH, cache_bytes: int = CACHE_BYTES, retention: float = DEFAULT_RETENTION):
+        super().__init__(path)
+        self.cache_bytes = cache_bytes
+        self.retention = retention
+        self._cache = OrderedDict()
+        self._cached = 0
+
+    def put(self, text: str) -> Handle:
+        """Store `text` and return its handle. Storing the same text again is free."""
+        raw = text.encode("utf-8")
+        handle = Handle(hashlib.sha256(raw).hexdigest(), len(raw))
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO artifacts (digest, size, data, used_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (digest) DO UPDATE SET used_at = excluded.used_at",
+                (handle.digest, handle.size, zlib.compress(raw), time.time()),
+            )
+            self._remember(handle, text)
+        return handle
+
+    def get(self, handle: Handle) -> str:
+        """Return the text of `handle`, or "" if it has been deleted."""
+        with self._lock:
+            text = self._cache.get(handle.digest)
+            if text is not None:
+                self._cache.move_to_end(handle.digest)
+                return text
+            with self.conn:
+                row = self.conn.execute("SELECT data FROM artifacts WHERE digest = ?", (handle.digest,)).fetchone()
+                if row is None:
+                    logger.warning("artifact %s is gone", handle.digest[:12])
+                    return ""
+                self.conn.execute("UPDATE artifacts SET used_at = ? WHERE digest = ?", (time.time(), handle.digest))
+            text = zlib.decompress(row[0]).decode("utf-8")
+            self._remember(handle, text)
+            return text
+
+    def _remember(self, handle, text):
+        # Called with the lock held
+        if handle.digest in self._cache:
+            self._cache.move_to_end(handle.digest)
+            return
+        self._cache[handle.digest] = text
+        self._cached += handle.size
+        while self._cached > self.cache_bytes and len(self._cache) > 1:
+            _, dropped = self._cache.popitem(last=False)
+            self._cached -= len(dropped.encode("utf-8"))
+
+    def prune(self) -> int:
+        """Delete artifacts unused for longer than the retention period."""
+        with self._lock, self.conn:
+            deleted = self.conn.execute(
+                "DELETE FROM artifacts WHERE used_at < ?", (time.time() - self.retention,)
+            ).rowcount
+        if deleted:
+            logger.info("pruned %d session artifacts", deleted)
+        return deleted
+
+    @property
+    def cached_bytes(self) -> int:
+        return self._cached
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, size, stored = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(LENGTH(data)), 0) FROM artifacts"
+            ).fetchone()
+            return {"artifacts": count, "bytes": size, "stored_bytes": stored, "cached_bytes": self._cached}
+
+
+def _size(value) -> int:
+    """Approximate bytes held by a session state value."""
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, Handle):
+        # The text itself is in the artifact store, or counted by its cache
+        return sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_size(key) + _size(item) for key, item in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+def _footprint(state) -> int:
+    """Approximate bytes held by the evictable fields of a session's state."""
+    size = 0
+    for field in EVICTABLE_FIELDS:
+        try:
+            size += _size(state[field])
+        except KeyError:
+            pass
+    return size
+
+
+# Memory the process holds on behalf of sessions outside their state, by
+# name; see `count_shared`
+_shared: Dict[str, Callable[[], int]] = {}
+
+
+def count_shared(name: str, measure: Callable[[], int]):
+    """Count the `measure()` bytes held for sessions outside their state toward the ceiling."""
+    _shared[name] = measure
+
+
+def shared_bytes() -> Dict[str, int]:
+    return {name: measure() for name, measure in list(_shared.items())}
+
+
+class SessionTracker:
+    """Last activity and footprint of every session in this process.
+
+    Footprints are measured when they are needed rather than when a session
+    is seen, so what a run writes after `touch` still counts.
+    """
+
+    def __init__(self, idle_ttl: float = IDLE_TTL, ceiling: int = MEMORY_CEILING, min_idle: float = MIN_IDLE):
+        self.idle_ttl = idle_ttl
+        self.ceiling = ceiling
+        self.min_idle = min_idle
+        self.evicted = 0
+        self._lock = threading.Lock()
+        # session id -> [last seen, its state]
+        self._sessions = {}
+        self._swept = 0.0
+
+    def touch(self, session_id: str, state):
+        """Record that `session_id`, whose state is `state`, is running now."""
+        with self._lock:
+            self._sessions[session_id] = [time.time(), state]
+
+    def _evict(self, session_id):
+        # Called with the lock held
+        _, state = self._sessions.pop(session_id)
+        for field in EVICTABLE_FIELDS:
+            try:
+                del state[field]
+            except KeyError:
+                pass
+        self.evicted += 1
+
+    def sweep(self, shared: int = 0, current: str = None) -> int:
+        """Evict idle sessions, then more until under the ceiling. Returns how many were evicted.
+
+        `shared` is the bytes held for sessions outside their state (see
+        `count_shared`). The `current` session, whose script is running, is
+        never evicted.
+        """
+        now = time.time()
+        evicted = self.evicted
+        with self._lock:
+            self._swept = now
+            runtime = Runtime.instance() if Runtime.exists() else None
+            for session_id, (seen, _) in list(self._sessions.items()):
+                if runtime is not None and not runtime.is_active_session(session_id):
+                    # Closed or disconnected; Streamlit manages its state from here
+                    del self._sessions[session_id]
+                elif now - seen > self.idle_ttl and session_id != current:
+                    self._evict(session_id)
+            sizes = {session_id: _footprint(state) for session_id, (_, state) in self._sessions.items()}
+            total = shared + sum(sizes.values())
+            for session_id, (seen, _) in sorted(self._sessions.items(), key=lambda item: item[1][0]):
+                if total <= self.ceiling or now - seen < self.min_idle:
+                    break
+                if session_id == current:
+                    continue
+                self._evict(session_id)
+                total -= sizes[session_id]
+            evicted = self.evicted - evicted
+        if evicted:
+            logger.info("evicted %d idle sessions", evicted)
+        return evicted
+
+    def due(self) -> bool:
+        return time.time() - self._swept > SWEEP_INTERVAL
+
+    def footprint(self) -> dict:
+        now = time.time()
+        with self._lock:
+            entries = list(self._sessions.values())
+        return {
+            "sessions": len(entries),
+            "sessions_active": sum(now - seen < self.min_idle for seen, _ in entries),
+            "session_bytes": sum(_footprint(state) for _, state in entries),
+            "sessions_evicted_total": self.evicted,
+        }
+
+
+@st.cache_resource
+def get_artifact_store():
+    store = ArtifactStore()
+    store.prune()
+    count_shared("artifact_cache", lambda: store.cached_bytes)
+    return store
+
+
+@st.cache_resource
+def get_session_tracker():
+    tracker = SessionTracker()
+    metrics.registry.register_collector(footprint)
+    return tracker
+
+
+def footprint() -> dict:
+    """Current memory footprint of sessions and the artifact cache in this process."""
+    stats = get_artifact_store().stats()
+    return dict(
+        get_session_tracker().footprint(),
+        **{f"shared_{name}_bytes": size for name, size in shared_bytes().items()},
+        artifacts=stats["artifacts"],
+        artifact_stored_bytes=stats["stored_bytes"],
+    )
+
+
+def track():
+    """Record this script run's session as active and, now and then, evict idle ones."""
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return
+    tracker = get_session_tracker()
+    tracker.touch(ctx.session_id, ctx.session_state)
+    if tracker.due():
+        get_artifact_store()  # registers the artifact cache with count_shared
+        tracker.sweep(sum(shared_bytes().values()), ctx.session_id)
+
+
+def read(field: str, default=""):
+    """Return session state `field`, loading it from the artifact store if offloaded."""
+    value = st.session_state.get(field, default)
+    if isinstance(value, Handle):
+        return get_artifact_store().get(value)
+    return value
+
+
+def write(field: str, value):
+    """Set session state `field`, offloading long texts to the artifact store."""
+    if isinstance(value, str) and len(value) > INLINE_LIMIT:
+        value = get_artifact_store().put(value)
+    st.session_state[field] = value
@@ -0,0 +1,166 @@
+"""Near-duplicate lookup of past briefs, to reuse their clarifying questions.
+
+Briefs are given as their field values, project description first, without
+the labels of the model input. Each is reduced to a MinHash signature over
+character shingles, half of it computed from the description alone and half
+from the whole brief, and indexed with locality-sensitive hashing: each
+signature is cut into bands, and briefs sharing any band bucket are
+candidates. A candidate's similarity is estimated from the fraction of
+matching signature values, which approximates the mean of the Jaccard
+similarities of the two descriptions and of the two whole briefs. Short
+briefs that only share common features and requirements ("login", "python")
+therefore stay apart.
+
+Briefs are indexed per owner, the signed-in user they came from, and a
+lookup only considers its caller's own briefs: questions written for one
+user's project are never offered to another user.
+
+The index lives in SQLite next to the response cache, is updated one brief at
+a time, and keeps at most `max_entries` briefs across all owners, dropping the
+least recently used.
+"""
+import hashlib
+import os
+import time
+from typing import NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from storage import SQLiteStore
+
+DEFAULT_PATH = os.environ.get("SIMILARITY_INDEX_PATH", os.path.join(".cache", "briefs.sqlite3"))
+DEFAULT_MAX_ENTRIES = int(os.environ.get("SIMILARITY_MAX_ENTRIES", 5000))
+# Above SERVE the stored questions are used as is; above SUGGEST they are offered
+SERVE_THRESHOLD = float(os.environ.get("SIMILARITY_SERVE_THRESHOLD", 0.9))
+SUGGEST_THRESHOLD = float(os.environ.get("SIMILARITY_SUGGEST_THRESHOLD", 0.6))
+
+SHINGLE_SIZE = 5
+NUM_PERM = 128
+# 32 bands of 4 rows: briefs of similarity 0.6 share a bucket with probability ~0.99
+BANDS = 32
+_PRIME = (1 << 31) - 1
+
+
+def _permutations(num_perm: int = NUM_PERM):
+    # Fixed seed: signatures must stay comparable across processes and restarts
+    rng = np.random.RandomState(1)
+    a = rng.randint(1, _PRIME, size=num_perm, dtype=np.uint64)
+    b = rng.randint(0, _PRIME, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+_A, _B = _permutations()
+
+
+def shingles(text: str) -> np.ndarray:
+    """Return the 32-bit hashes of the character shingles of normalized `text`."""
+    text = " ".join(text.lower().split())
+    if len(text) < SHINGLE_SIZE:
+        text = text.ljust(SHINGLE_SIZE)
+    hashes = set()
+    for i in range(len(text) - SHINGLE_SIZE + 1):
+        digest = hashlib.blake2b(text[i:i + SHINGLE_SIZE].encode("utf-8"), digest_size=4).digest()
+        hashes.add(int.from_bytes(digest, "little"))
+    return np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+
+
+def _minhash(values: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # (a * x + b) mod p for every permutation and shingle; fits in 64 bits
+    return ((np.outer(a, values) + b[:, None]) % _PRIME).min(axis=1).astype(np.uint32)
+
+
+def signature(fields: Sequence[str]) -> np.ndarray:
+    """Return the MinHash signature of a brief given its field values, description first."""
+    half = NUM_PERM // 2
+    return np.concatenate([
+        _minhash(shingles(fields[0]), _A[:half], _B[:half]),
+        _minhash(shingles("\n".join(fields)), _A[half:], _B[half:]),
+    ])
+
+
+def similarity(first: np.ndarray, second: np.ndarray) -> float:
+    """Estimate the Jaccard similarity of two briefs from their signatures."""
+    return float(np.mean(first == second))
+
+
+def _band_keys(sig: np.ndarray):
+    """Return the (band, bucket) pairs of a signature."""
+    rows = len(sig) // BANDS
+    keys = []
+    for band in range(BANDS):
+        digest = hashlib.blake2b(sig[band * rows:(band + 1) * rows].tobytes(), digest_size=8).digest()
+        keys.append((band, int.from_bytes(digest, "little", signed=True)))
+    return keys
+
+
+class Match(NamedTuple):
+    brief_id: int
+    score: float
+    questions: str
+
+
+class SimilarityIndex(SQLiteStore):
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS briefs ("
+        "id INTEGER PRIMARY KEY, signature BLOB NOT NULL, questions TEXT NOT NULL, "
+        "created_at REAL NOT NULL, used_at REAL NOT NULL, owner TEXT)",
+        "CREATE TABLE IF NOT EXISTS bands ("
+        "band INTEGER NOT NULL, bucket INTEGER NOT NULL, brief_id INTEGER NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS bands_bucket ON bands (band, bucket)",
+        "CREATE INDEX IF NOT EXISTS bands_brief ON bands (brief_id)",
+    )
+
+    def __init__(self, path: str = DEFAULT_PATH, max_entries: int = DEFAULT_MAX_ENTRIES):
+        super().__init__(path)
+        self.max_entries = max_entries
+        with self._lock, self.conn:
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(briefs)")}
+            if "owner" not in columns:
+                # Indexes from before briefs had owners; their briefs stay anonymous
+                self.conn.execute("ALTER TABLE briefs ADD COLUMN owner TEXT")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM briefs").fetchone()[0]
+
+    def lookup(self, fields: Sequence[str], threshold: float = SUGGEST_THRESHOLD, owner: Optional[str] = None) -> Optional[Match]:
+        """Return `owner`'s stored brief most similar to `fields` scoring at least `threshold`, if any."""
+        sig = signature(fields)
+        keys = _band_keys(sig)
+        with self._lock:
+            candidates = self.conn.execute(
+                "SELECT DISTINCT briefs.id, briefs.signature, briefs.questions FROM bands "
+                "JOIN briefs ON briefs.id = bands.brief_id WHERE briefs.owner IS ? AND ("
+                + " OR ".join(["(band = ? AND bucket = ?)"] * len(keys)) + ")",
+                [owner] + [value for key in keys for value in key],
+            ).fetchall()
+        best = None
+        for brief_id, blob, questions in candidates:
+            score = similarity(sig, np.frombuffer(blob, dtype=np.uint32))
+            if score >= threshold and (best is None or score > best.score):
+                best = Match(brief_id, score, questions)
+        if best is not None:
+            with self._lock, self.conn:
+                self.conn.execute("UPDATE briefs SET used_at = ? WHERE id = ?", (time.time(), best.brief_id))
+        return best
+
+    def add(self, fields: Sequence[str], questions: str, owner: Optional[str] = None) -> int:
+        """Index `owner`'s brief `fields` with its clarifying questions. Returns its id."""
+        sig = signature(fields)
+        now = time.time()
+        with self._lock, self.conn:
+            brief_id = self.conn.execute(
+                "INSERT INTO briefs (signature, questions, created_at, used_at, owner) VALUES (?, ?, ?, ?, ?)",
+                (sig.tobytes(), questions, now, now, owner),
+            ).lastrowid
+            self.conn.executemany(
+                "INSERT INTO bands (band, bucket, brief_id) VALUES (?, ?, ?)",
+                [(band, bucket, brief_id) for band, bucket in _band_keys(sig)],
+            )
+            stale = [row[0] for row in self.conn.execute(
+                "SELECT id FROM briefs ORDER BY used_at DESC LIMIT -1 OFFSET ?", (self.max_entries,)
+            )]
+            if stale:
+                self.conn.executemany("DELETE FROM bands WHERE brief_id = ?", [(i,) for i in stale])
+                self.conn.executemany("DELETE FROM briefs WHERE id = ?", [(i,) for i in stale])
+        return brief_id
@@ -0,0 +1,121 @@
+"""Coalescing of identical model requests that are in flight at the same time.
+
+The first caller for a key (the leader) makes the request; callers arriving
+with the same key before it finishes wait for the leader's result instead of
+making their own. A streamed request runs as a shared `StreamTask` on the
+flights' own worker pool rather than on any caller's thread, and every caller
+reads its chunks as they arrive, from the start. It is cancelled only once all
+of its readers have stopped, so one caller giving up does not fail the others.
+
+Keys should identify everything that determines the response; the response
+cache key does.
+"""
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterator
+
+import metrics
+from tasks import StreamTask
+
+
+def _finished(flight) -> bool:
+    if isinstance(flight, Future):
+        return flight.done()
+    return flight.done or flight.cancelled
+
+
+class SingleFlight:
+    def __init__(self, workers: int = 32):
+        self._calls = {}
+        self._streams = {}
+        # Stream task id -> callers still reading it
+        self._readers = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm-flight")
+
+    def _join(self, flights, key, make):
+        """Return (flight, is_leader) for `key`, creating the flight if there is none."""
+        with self._lock:
+            flight = flights.get(key)
+            if flight is not None and not _finished(flight):
+                return flight, False
+            flight = flights[key] = make()
+            return flight, True
+
+    def _leave(self, flights, key, flight):
+        with self._lock:
+            if flights.get(key) is flight:
+                del flights[key]
+
+    def do(self, key: str, fn: Callable, **labels):
+        """Return `fn()`, sharing one call among concurrent callers with `key`.
+
+        Followers get the leader's result, or its exception. `labels` tag the
+        coalesced-request counter.
+        """
+        future, leader = self._join(self._calls, key, Future)
+        if not leader:
+            metrics.registry.inc("llm_coalesced_total", **labels)
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._leave(self._calls, key, future)
+
+    async def ado(self, key: str, fn: Callable, **labels):
+        """Async counterpart of `do`; `fn` returns an awaitable.
+
+        Flights are shared with `do`, so sync and async callers coalesce too.
+        """
+        future, leader = self._join(self._calls, key, Future)
+        if not leader:
+            metrics.registry.inc("llm_coalesced_total", **labels)
+            return await asyncio.wrap_future(future)
+        try:
+            result = await fn()
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._leave(self._calls, key, future)
+
+    def stream(self, key: str, make_stream: Callable[[], Iterator[str]], **labels) -> Iterator[str]:
+        """Yield the chunks of `make_stream()`, fanning one stream out to concurrent callers.
+
+        The stream runs on the flight pool. Closing this iterator early
+        detaches the caller; the stream is cancelled when its last reader
+        detaches before it has finished.
+        """
+        with self._lock:
+            task = self._streams.get(key)
+            leader = task is None or _finished(task)
+            if leader:
+                task = self._streams[key] = StreamTask(make_stream)
+            self._readers[task.id] = self._readers.get(task.id, 0) + 1
+        if leader:
+            task.start(self._executor)
+        else:
+            metrics.registry.inc("llm_coalesced_total", **labels)
+        try:
+            yield from task.chunks()
+        finally:
+            with self._lock:
+                self._readers[task.id] -= 1
+                last = not self._readers[task.id]
+                if last:
+                    del self._readers[task.id]
+                    if self._streams.get(key) is task:
+                        del self._streams[key]
+            if last and not task.done:
+                # Nobody is left to read the rest
+                task.cancel()
@@ -0,0 +1,39 @@
+"""SQLite files behind the app's local stores.
+
+The response cache, checkpoints, similarity index, prompt history and session
+artifacts each keep their own SQLite file, by default under .cache/. A store
+opens one connection with `connect` and shares it between the script and
+worker threads. A connection must not run statements from two threads at
+once, so `SQLiteStore` pairs it with a lock that every statement is run under.
+"""
+import os
+import sqlite3
+import threading
+
+# Seconds to wait for another process's write lock before failing
+TIMEOUT = 10
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """Open the database at `path` for use from any thread, creating its directory."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    return sqlite3.connect(path, check_same_thread=False, timeout=TIMEOUT)
+
+
+class SQLiteStore:
+    """A store on one connection, `conn`; run statements with `_lock` held.
+
+    Subclasses list the statements creating their tables and indexes in
+    SCHEMA; they run when the store is opened.
+    """
+
+    SCHEMA = ()
+
+    def __init__(self, path: str):
+        self.conn = connect(path)
+        self._lock = threading.Lock()
+        with self._lock, self.conn:
+            for statement in self.SCHEMA:
+                self.conn.execute(statement)
@@ -0,0 +1,185 @@
+"""Local stand-in for the Anthropic Messages API, for load tests.
+
+Serves POST /v1/messages, plain or streamed (server-sent events), with a
+deterministic reply after a configurable first-token latency and token rate.
+Point the app at it with ANTHROPIC_BASE_URL:
+
+    python stub_llm.py --port 8765 --latency 0.8 --tokens-per-second 60
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8765 streamlit run home.py
+
+Only the parts of the API the app uses are implemented. The same replies
+back the in-process synthetic transport (LLM_TRANSPORT=synthetic, see
+transport.py).
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "frontend backend database docker compose terraform makefile react flask "
+    "postgres tests routes models schemas linting pipeline deploy build"
+).split()
+
+
+class StubConfig:
+    """How the stub replies, and how many requests it has served.
+
+    `latency` is the seconds before the first token and `tokens_per_second`
+    the output rate after it (0 means instant). Replies are `output_tokens`
+    long, capped by the request's max_tokens. `jitter` varies the latency
+    uniformly by up to that fraction either way.
+    """
+
+    def __init__(self, latency: float = 0.5, tokens_per_second: float = 50.0, output_tokens: int = 200, jitter: float = 0.0):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.output_tokens = output_tokens
+        self.jitter = jitter
+        self._lock = threading.Lock()
+        self.requests = 0
+
+    def count(self):
+        with self._lock:
+            self.requests += 1
+
+
+def _text(body) -> str:
+    content = body["messages"][-1]["content"]
+    if isinstance(content, list):
+        content = "".join(block.get("text", "") for block in content)
+    return content
+
+
+def _reply(body, config: StubConfig):
+    prompt = _text(body)
+    rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).digest())
+    tokens = [rng.choice(WORDS) + " " for _ in range(min(config.output_tokens, body.get("max_tokens", 1024)))]
+    # The prompt-caching fields are always present in real replies, if zero
+    usage = {
+        "input_tokens": len(prompt) // 4,
+        "output_tokens": len(tokens),
+        "cache_creation_input_tokens": 0,
+        "cache_read_input_tokens": 0,
+    }
+    return tokens, usage
+
+
+def _event(name, data) -> bytes:
+    return f"event: {name}\ndata: {json.dumps(dict(data, type=name))}\n\n".encode("utf-8")
+
+
+def exchange(body, config: StubConfig):
+    """Return the content type and the parts of the reply to request `body`.
+
+    Each part is (seconds to wait before it, bytes). A streamed reply is one
+    part per server-sent event group; a plain reply is a single part.
+    """
+    tokens, usage = _reply(body, config)
+    latency = config.latency * (1 + random.uniform(-config.jitter, config.jitter))
+    delay = 1 / config.tokens_per_second if config.tokens_per_second else 0
+    message = {
+        "id": "msg_stub",
+        "type": "message",
+        "role": "assistant",
+        "model": body["model"],
+        "content": [],
+        "stop_reason": None,
+        "stop_sequence": None,
+        "usage": usage,
+    }
+    if not body.get("stream"):
+        message.update(content=[{"type": "text", "text": "".join(tokens)}], stop_reason="end_turn")
+        return "application/json", [(latency + delay * len(tokens), json.dumps(message).encode("utf-8"))]
+    parts = [(latency, _event("message_start", {"message": message})
+              + _event("content_block_start", {"index": 0, "content_block": {"type": "text", "text": ""}}))]
+    for i, token in enumerate(tokens):
+        parts.append((delay if i else 0, _event(
+            "content_block_delta", {"index": 0, "delta": {"type": "text_delta", "text": token}}
+        )))
+    parts.append((0, _event("content_block_stop", {"index": 0})
+                  # The final usage repeats the input and cache counts, as the API's does
+                  + _event("message_delta", {
+                      "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                      "usage": usage,
+                  })
+                  + _event("message_stop", {})))
+    return "text/event-stream", parts
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config: StubConfig = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if self.path.split("?")[0].rstrip("/") != "/v1/messages":
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.config.count()
+        content_type, parts = exchange(body, self.config)
+        if content_type != "text/event-stream":
+            (wait, data), = parts
+            time.sleep(wait)
+            self._send(200, content_type, data)
+            return
+        # Headers go out with the first event, as the real API's do
+        time.sleep(parts[0][0])
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, (wait, data) in enumerate(parts):
+            if i and wait:
+                time.sleep(wait)
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _send(self, status, content_type, data):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve(port: int = 0, config: StubConfig = None, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Start the stub on a background thread and return the server.
+
+    Port 0 picks a free port; see `server.server_address`.
+    """
+    handler = type("Handler", (_Handler,), {"config": config or StubConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stub-llm", daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a stub Anthropic Messages API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds to first token (default 0.5)")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="output rate, 0 for instant")
+    parser.add_argument("--output-tokens", type=int, default=200, help="reply length in tokens")
+    parser.add_argument("--jitter", type=float, default=0.0, help="latency spread as a fraction, e.g. 0.5")
+    args = parser.parse_args(argv)
+
+    config = StubConfig(args.latency, args.tokens_per_second, args.output_tokens, args.jitter)
+    server = serve(args.port, config, args.host)
+    print(f"stub LLM listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""Background generation jobs that can be attached to while they run.
+
+A `StreamTask` drains a text-chunk generator on a worker thread and records
+every chunk, so a Streamlit run can start a generation, rerun, and later replay
+the chunks produced so far before following the rest live.
+
+`JobQueue` runs tasks on a bounded worker pool, hands out job ids that can be
+kept in session state, and refuses new jobs once its queue is full. Waiting
+jobs are started fair-share: next is the oldest job of whichever owner has the
+fewest jobs running, taking turns between owners, so one user's burst is
+interleaved with everyone else's work instead of running ahead of it.
+"""
+import contextvars
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, Optional
+
+
+class TaskCancelled(Exception):
+    """Raised to readers of a task that was cancelled before it finished."""
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted to a queue that is at its depth limit."""
+
+
+class StreamTask:
+    def __init__(self, make_stream: Callable[[], Iterator[str]], owner: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._make_stream = make_stream
+        self._chunks = []
+        self._done = False
+        self._cancelled = False
+        self._error: Optional[BaseException] = None
+        self._condition = threading.Condition()
+        # Context variables of the creator (such as who is charged for the
+        # task's model calls) carry over to the worker thread
+        self._context = contextvars.copy_context()
+
+    def start(self, executor) -> "StreamTask":
+        """Run the task on `executor` (a `concurrent.futures.Executor`)."""
+        executor.submit(self.run)
+        return self
+
+    def run(self):
+        """Run the task to completion on the calling thread."""
+        self._context.run(self._run)
+
+    def _run(self):
+        try:
+            for _ in self.drive():
+                pass
+        except BaseException:
+            # Recorded on the task by drive(); readers re-raise it
+            pass
+
+    def drive(self) -> Iterator[str]:
+        """Run the task on the calling thread, yielding each chunk as it is recorded.
+
+        Other readers follow along through `chunks()`. Closing this iterator
+        early cancels the task for them.
+        """
+        stream = None
+        self.started_at = time.time()
+        try:
+            if self._cancelled:
+                return
+            stream = self._make_stream()
+            for chunk in stream:
+                with self._condition:
+                    if self._cancelled:
+                        break
+                    self._chunks.append(chunk)
+                    self._condition.notify_all()
+                yield chunk
+        except GeneratorExit:
+            self._cancelled = True
+            raise
+        except BaseException as exc:
+            self._error = exc
+            raise
+        finally:
+            if stream is not None and hasattr(stream, "close"):
+                stream.close()
+            with self._condition:
+                self.finished_at = time.time()
+                self._done = True
+                self._condition.notify_all()
+
+    @property
+    def done(self) -> bool:
+        return self._done
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    @property
+    def error(self) -> Optional[BaseException]:
+        """The exception the task failed with, if any."""
+        return self._error
+
+    @property
+    def text(self) -> str:
+        """Text produced so far."""
+        with self._condition:
+            return "".join(self._chunks)
+
+    def cancel(self):
+        """Stop the task after its current chunk. Readers get `TaskCancelled`."""
+        with self._condition:
+            self._cancelled = True
+            self._condition.notify_all()
+
+    def chunks(self) -> Iterator[str]:
+        """Yield every chunk from the start, waiting for new ones until the task ends.
+
+        Closing this iterator only detaches the reader; the task keeps running.
+        """
+        i = 0
+        while True:
+            with self._condition:
+                while i >= len(self._chunks) and not self._done and not self._cancelled:
+                    self._condition.wait()
+                pending = self._chunks[i:]
+                finished = self._done or self._cancelled
+            yield from pending
+            i += len(pending)
+            if finished and i >= len(self._chunks):
+                break
+        self._raise_for_status()
+
+    def result(self, timeout: Optional[float] = None) -> str:
+        """Wait for the task to finish and return its full text."""
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._done or self._cancelled, timeout):
+                raise TimeoutError("task did not finish in time")
+        self._raise_for_status()
+        return self.text
+
+    def _raise_for_status(self):
+        if self._cancelled:
+            raise TaskCancelled()
+        if self._error is not None:
+            raise self._error
+
+
+class JobQueue:
+    """Bounded pool of `StreamTask` jobs, looked up by id.
+
+    At most `workers` jobs run at once and at most `max_queued` more wait for a
+    worker; beyond that `submit` raises `QueueFull` so callers can ask the user
+    to retry instead of piling up work. Waiting jobs start in fair-share order
+    across owners. Finished jobs are kept for `retention` seconds so a later
+    rerun can still collect their result.
+    """
+
+    def __init__(self, workers: int = 8, max_queued: int = 32, retention: float = 600):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm-job")
+        self._jobs = {}
+        self._pending = []
+        self._running = {}
+        # Order in which owners with waiting or running jobs last had one started
+        self._turns = {}
+        self._started = 0
+        self._lock = threading.Lock()
+
+    def submit(self, make_stream: Callable[[], Iterator[str]], owner: Optional[str] = None) -> StreamTask:
+        """Queue a job generating `make_stream()`, on behalf of `owner` if given."""
+        with self._lock:
+            self._prune()
+            if sum(not job.done for job in self._jobs.values()) >= self.workers + self.max_queued:
+                raise QueueFull()
+            job = StreamTask(make_stream, owner)
+            self._jobs[job.id] = job
+            self._pending.append(job)
+            self._dispatch()
+        return job
+
+    def _dispatch(self):
+        # Called with the lock held: start waiting jobs while workers are free
+        while self._pending and sum(self._running.values()) < self.workers:
+            job = min(self._pending, key=lambda job: (
+                self._running.get(job.owner, 0), self._turns.get(job.owner, -1), job.submitted_at
+            ))
+            self._pending.remove(job)
+            self._running[job.owner] = self._running.get(job.owner, 0) + 1
+            self._started += 1
+            self._turns[job.owner] = self._started
+            self._executor.submit(self._work, job)
+
+    def _work(self, job: StreamTask):
+        try:
+            job.run()
+        finally:
+            with self._lock:
+                self._running[job.owner] -= 1
+                if not self._running[job.owner]:
+                    del self._running[job.owner]
+                    if not any(pending.owner == job.owner for pending in self._pending):
+                        del self._turns[job.owner]
+                self._dispatch()
+
+    def get(self, job_id: Optional[str]) -> Optional[StreamTask]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: Optional[str]):
+        job = self.get(job_id)
+        if job is not None:
+            job.cancel()
+
+    def text_bytes(self) -> int:
+        """Approximate bytes of text held by the jobs, running or retained."""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return sum(len(job.text.encode("utf-8")) for job in jobs)
+
+    def stats(self) -> dict:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        running = sum(job.started_at is not None and not job.done for job in jobs)
+        queued = sum(job.started_at is None and not job.done for job in jobs)
+        return {"running": running, "queued": queued, "finished": len(jobs) - running - queued}
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        for job_id, job in list(self._jobs.items()):
+            if job.done and job.finished_at is not None and job.finished_at < cutoff:
+                del self._jobs[job_id]
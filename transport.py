@@ -0,0 +1,333 @@
+"""Record, replay and synthetic transports for the Anthropic HTTP client.
+
+Selected with LLM_TRANSPORT:
+
+    live       (default) talk to the API
+    record     talk to the API and append every exchange to the cassette
+    replay     answer from the cassette; the API is never contacted
+    synthetic  answer with generated replies (see stub_llm.py); no API either
+
+The cassette (LLM_CASSETTE, default .cache/cassette.jsonl.gz) is gzipped JSON
+lines, one exchange per line: a digest of the request body, the response
+status and headers, and the response body as chunks, each with its offset in
+seconds from the start of the request. Streaming replies therefore keep their
+time to first token and token rate.
+
+Replay matches requests by body. Repeats of one request are answered with its
+recordings in turn; a request never recorded gets a 404 error response.
+LLM_REPLAY_SPEED scales the recorded timings: 1 replays them as recorded, 2
+twice as fast, 0 without any delay. Synthetic replies take their latency and
+throughput from LLM_SYNTHETIC_LATENCY, LLM_SYNTHETIC_TOKENS_PER_SECOND,
+LLM_SYNTHETIC_OUTPUT_TOKENS and LLM_SYNTHETIC_JITTER.
+
+    LLM_TRANSPORT=record streamlit run home.py      # use the app once
+    LLM_TRANSPORT=replay LLM_REPLAY_SPEED=0 python bench.py
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+import stub_llm
+
+MODE = os.environ.get("LLM_TRANSPORT", "live")
+CASSETTE = os.environ.get("LLM_CASSETTE", os.path.join(".cache", "cassette.jsonl.gz"))
+REPLAY_SPEED = float(os.environ.get("LLM_REPLAY_SPEED", 1))
+# Response headers worth keeping; the rest vary per call or describe the wire.
+# Chunks are recorded as they came off the wire, still compressed, so their
+# content-encoding is kept to decode them on replay.
+KEPT_HEADERS = ("content-type", "content-encoding", "retry-after", "request-id")
+
+# Replay and synthetic runs need no API key
+OFFLINE = MODE in ("replay", "synthetic")
+
+logger = logging.getLogger(__name__)
+
+
+def request_key(request: httpx.Request) -> str:
+    """Digest identifying a request by method, path and JSON body."""
+    body = request.content
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True, separators=(",", ":")).encode("utf-8")
+    except ValueError:
+        pass
+    return hashlib.sha256(request.method.encode() + b" " + request.url.path.encode() + b"\n" + body).hexdigest()
+
+
+def _error(status: int, kind: str, message: str) -> httpx.Response:
+    return httpx.Response(status, json={"type": "error", "error": {"type": kind, "message": message}})
+
+
+class Cassette:
+    """Recorded exchanges, appended to and read from one gzipped JSONL file."""
+
+    def __init__(self, path: str = CASSETTE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Optional[Dict[str, List[dict]]] = None
+        self._served: Dict[str, int] = {}
+
+    def append(self, entry: dict):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            # Each append is its own gzip member; readers see one stream
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+            if self._entries is not None:
+                self._entries.setdefault(entry["key"], []).append(entry)
+
+    def _load(self):
+        # Called with the lock held
+        self._entries = {}
+        if not os.path.exists(self.path):
+            logger.warning("cassette %s does not exist; every request will miss", self.path)
+            return
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                self._entries.setdefault(entry["key"], []).append(entry)
+        logger.info("loaded %d recorded exchanges from %s", sum(map(len, self._entries.values())), self.path)
+
+    def next(self, key: str) -> Optional[dict]:
+        """Return the next recording of request `key`, cycling through repeats."""
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            entries = self._entries.get(key)
+            if not entries:
+                return None
+            served = self._served.get(key, 0)
+            self._served[key] = served + 1
+            return entries[served % len(entries)]
+
+
+class _Recorder:
+    """Collects a response's chunks and their timings, then saves the exchange."""
+
+    def __init__(self, cassette: Cassette, key: str, response: httpx.Response, started: float):
+        self.cassette = cassette
+        self.started = started
+        self.entry = {
+            "key": key,
+            "status": response.status_code,
+            "headers": {name: response.headers[name] for name in KEPT_HEADERS if name in response.headers},
+            "chunks": [],
+        }
+
+    def add(self, chunk: bytes):
+        # latin-1 maps bytes to characters one to one, so any chunk round-trips
+        self.entry["chunks"].append([round(time.monotonic() - self.started, 4), chunk.decode("latin-1")])
+
+    def save(self):
+        self.cassette.append(self.entry)
+
+
+class _RecordingStream(httpx.SyncByteStream):
+    def __init__(self, stream, recorder: _Recorder):
+        self._stream = stream
+        self._recorder = recorder
+
+    def __iter__(self):
+        for chunk in self._stream:
+            self._recorder.add(chunk)
+            yield chunk
+        # Only complete responses are worth replaying
+        self._recorder.save()
+
+    def close(self):
+        self._stream.close()
+
+
+class _AsyncRecordingStream(httpx.AsyncByteStream):
+    def __init__(self, stream, recorder: _Recorder):
+        self._stream = stream
+        self._recorder = recorder
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            self._recorder.add(chunk)
+            yield chunk
+        self._recorder.save()
+
+    async def aclose(self):
+        await self._stream.aclose()
+
+
+class _TimedStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """Yields (offset, bytes) chunks no earlier than their offset from `started`."""
+
+    def __init__(self, chunks, started: float, speed: float):
+        self._chunks = chunks
+        self._started = started
+        self._speed = speed
+
+    def _wait(self, offset):
+        if not self._speed:
+            return 0
+        return self._started + offset / self._speed - time.monotonic()
+
+    def __iter__(self):
+        for offset, data in self._chunks:
+            wait = self._wait(offset)
+            if wait > 0:
+                time.sleep(wait)
+            yield data
+
+    async def __aiter__(self):
+        for offset, data in self._chunks:
+            wait = self._wait(offset)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            yield data
+
+
+class ReplayTransport:
+    """Answers requests from a cassette. Wrap in a sync or async transport, see `sync_transport`."""
+
+    def __init__(self, cassette: Cassette, speed: float = REPLAY_SPEED):
+        self.cassette = cassette
+        self.speed = speed
+
+    def respond(self, request):
+        started = time.monotonic()
+        entry = self.cassette.next(request_key(request))
+        if entry is None:
+            return _error(404, "not_found_error", f"no recorded response for this request in {self.cassette.path}")
+        chunks = [(offset, data.encode("latin-1")) for offset, data in entry["chunks"]]
+        return httpx.Response(entry["status"], headers=entry["headers"], stream=_TimedStream(chunks, started, self.speed))
+
+
+class SyntheticTransport:
+    """Answers requests with generated replies. Wrap like `ReplayTransport`."""
+
+    def __init__(self, config: Optional[stub_llm.StubConfig] = None):
+        self.config = config or stub_llm.StubConfig(
+            latency=float(os.environ.get("LLM_SYNTHETIC_LATENCY", 0.5)),
+            tokens_per_second=float(os.environ.get("LLM_SYNTHETIC_TOKENS_PER_SECOND", 50)),
+            output_tokens=int(os.environ.get("LLM_SYNTHETIC_OUTPUT_TOKENS", 200)),
+            jitter=float(os.environ.get("LLM_SYNTHETIC_JITTER", 0)),
+        )
+
+    def respond(self, request):
+        started = time.monotonic()
+        if request.url.path.rstrip("/") != "/v1/messages":
+            return _error(404, "not_found_error", f"synthetic transport does not serve {request.url.path}")
+        self.config.count()
+        content_type, parts = stub_llm.exchange(json.loads(request.content), self.config)
+        chunks, offset = [], 0.0
+        for wait, data in parts:
+            offset += wait
+            chunks.append((offset, data))
+        return httpx.Response(200, headers={"content-type": content_type}, stream=_TimedStream(chunks, started, 1))
+
+
+class _SyncOffline(httpx.BaseTransport):
+    def __init__(self, offline):
+        self.offline = offline
+
+    def handle_request(self, request):
+        return self.offline.respond(request)
+
+
+class _AsyncOffline(httpx.AsyncBaseTransport):
+    def __init__(self, offline):
+        self.offline = offline
+
+    async def handle_async_request(self, request):
+        return self.offline.respond(request)
+
+
+class RecordTransport(httpx.BaseTransport):
+    """Passes requests to `inner` and records each complete exchange."""
+
+    def __init__(self, inner: httpx.BaseTransport, cassette: Cassette):
+        self.inner = inner
+        self.cassette = cassette
+
+    def handle_request(self, request):
+        started = time.monotonic()
+        key = request_key(request)
+        response = self.inner.handle_request(request)
+        recorder = _Recorder(self.cassette, key, response, started)
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=_RecordingStream(response.stream, recorder),
+            extensions=response.extensions,
+        )
+
+    def close(self):
+        self.inner.close()
+
+
+class AsyncRecordTransport(httpx.AsyncBaseTransport):
+    """Async counterpart of `RecordTransport`."""
+
+    def __init__(self, inner: httpx.AsyncBaseTransport, cassette: Cassette):
+        self.inner = inner
+        self.cassette = cassette
+
+    async def handle_async_request(self, request):
+        started = time.monotonic()
+        key = request_key(request)
+        response = await self.inner.handle_async_request(request)
+        recorder = _Recorder(self.cassette, key, response, started)
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=_AsyncRecordingStream(response.stream, recorder),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+
+# One cassette and one synthetic generator per process, so replays advance
+# through repeats consistently across clients
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def _get_shared(name, make):
+    with _shared_lock:
+        if name not in _shared:
+            _shared[name] = make()
+        return _shared[name]
+
+
+def _offline():
+    if MODE == "replay":
+        return _get_shared("replay", lambda: ReplayTransport(Cassette()))
+    return _get_shared("synthetic", SyntheticTransport)
+
+
+def sync_transport(limits: httpx.Limits) -> httpx.BaseTransport:
+    """Return the transport for a sync client with connection `limits`, per LLM_TRANSPORT."""
+    if OFFLINE:
+        return _SyncOffline(_offline())
+    live = httpx.HTTPTransport(limits=limits)
+    if MODE == "record":
+        return RecordTransport(live, _get_shared("cassette", Cassette))
+    if MODE != "live":
+        logger.warning("unknown LLM_TRANSPORT %r; using live", MODE)
+    return live
+
+
+def async_transport(limits: httpx.Limits) -> httpx.AsyncBaseTransport:
+    """Async counterpart of `sync_transport`."""
+    if OFFLINE:
+        return _AsyncOffline(_offline())
+    live = httpx.AsyncHTTPTransport(limits=limits)
+    if MODE == "record":
+        return AsyncRecordTransport(live, _get_shared("cassette", Cassette))
+    return live